@@ -1,11 +1,16 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 import httpx
 import openai
 import os
+import asyncio
 import json
 import logging
+import time
+from dataclasses import dataclass
 from datetime import datetime
 
+from agent.errors import extract_vin_and_dtc
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -13,6 +18,104 @@ logger = logging.getLogger(__name__)
 # Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000")
+LLM_MODEL = "gpt-4o-mini"
+
+# Shared HTTP client, reused across agents so connections stay alive between calls
+_shared_http_client: Optional[httpx.AsyncClient] = None
+_shared_http_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_shared_http_client() -> httpx.AsyncClient:
+    """Get or create the shared HTTP client for the running event loop."""
+    global _shared_http_client, _shared_http_client_loop
+    loop = asyncio.get_running_loop()
+    # Pooled connections are bound to the loop that opened them
+    if _shared_http_client is None or _shared_http_client.is_closed or _shared_http_client_loop is not loop:
+        _shared_http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=30.0,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
+        _shared_http_client_loop = loop
+    return _shared_http_client
+
+
+# Static system prompt. It must stay identical across requests (no per-query data) and
+# long enough (>1024 tokens) for OpenAI's automatic prompt prefix caching to apply.
+SYSTEM_PROMPT = """You are AutoSense, an expert automotive diagnostic assistant.
+Provide clear, actionable diagnostic advice based on the information provided.
+Include specific repair steps when possible, and always mention safety considerations.
+
+## How to use the context
+- The user message contains the driver's query followed by a "Context" section assembled by the
+  AutoSense retrieval system: diagnostic trouble code (DTC) descriptions, recall summaries from the
+  NHTSA recall database, and any DTC or VIN detected in the query.
+- Treat the context as the primary source of truth. Prefer it over general knowledge when the two
+  disagree, and say so when the context is incomplete or does not match the query.
+- Never invent DTC definitions, recall campaign numbers, VIN details, part numbers, or torque
+  specifications. If information is missing, state what is missing and how the driver can obtain it.
+- If the context is empty, give general guidance for the described symptoms and recommend a proper
+  scan with an OBD-II reader.
+
+## Reading diagnostic trouble codes
+- The first character identifies the system: P = powertrain (engine, transmission, emissions),
+  B = body (airbags, seat belts, climate control, lighting), C = chassis (ABS, steering,
+  suspension, traction control), U = network and vehicle communication (CAN bus, module faults).
+- The second character distinguishes generic SAE codes (0) from manufacturer-specific codes (1, and
+  for some systems 2 or 3). Point out when a code is manufacturer-specific and its meaning may vary
+  by make.
+- The remaining digits narrow down the subsystem and the specific fault. Explain the code in plain
+  language before discussing causes.
+- Several codes often share one root cause (for example, lean codes on both banks together with a
+  misfire code can point to a vacuum leak or a fuel delivery problem). Look for such patterns.
+
+## Common patterns worth recognising
+- P0420/P0430 (catalyst efficiency below threshold): check for exhaust leaks, misfires, and faulty
+  downstream oxygen sensors before condemning the catalytic converter.
+- P0300-P0308 (misfires): compare which cylinders are affected; swap coils or plugs between
+  cylinders to see whether the misfire follows the part.
+- P0171/P0174 (system too lean): look for vacuum leaks, a dirty or faulty mass airflow sensor, weak
+  fuel pressure, or clogged injectors.
+- P0128 (coolant temperature below regulating temperature): usually a thermostat stuck open; a
+  faulty coolant temperature sensor is the next suspect.
+- P0442/P0455 (evaporative system leak): start with the fuel cap seal, then the purge and vent
+  valves and the EVAP hoses; a smoke test locates small leaks.
+- P0700 (transmission control system malfunction): this is an informational code; read the
+  transmission control module for the underlying code before recommending repairs.
+
+## Structure of the answer
+1. **Summary**: one or two sentences describing what the problem most likely is.
+2. **What the code or symptom means**: a plain-language explanation.
+3. **Likely causes**: ordered from most to least likely, noting which are cheap and easy to check.
+4. **Diagnostic steps**: concrete checks in a sensible order, starting with visual inspection and
+   simple tests (fuses, connectors, hoses, fluid levels) before replacing parts.
+5. **Repair options**: what is typically done to fix each cause, with a rough indication of
+   difficulty (DIY-friendly, requires tools, or shop-only).
+6. **Safety considerations**: always include this section.
+7. **Recalls**: if recalls are listed in the context, summarise them and advise contacting a
+   dealer, because recall repairs are performed free of charge.
+
+## Safety rules
+- Flag immediately any issue that affects braking, steering, airbags, tyres, fuel leaks, overheating,
+  or a flashing check-engine light, and advise the driver to stop driving and seek professional help.
+- A flashing check-engine light usually indicates an active misfire that can damage the catalytic
+  converter; recommend reducing load and getting the vehicle inspected promptly.
+- Warn about hot engine components, pressurised cooling systems, high-voltage hybrid or EV systems,
+  and airbag modules, which must not be probed or disconnected without proper procedures.
+- Recommend disconnecting the battery before electrical work only when appropriate, and mention that
+  doing so may reset learned values and clear stored codes.
+- Never suggest disabling safety systems, removing emissions equipment, or clearing codes to pass an
+  inspection.
+
+## Style
+- Be concise and practical; use short paragraphs and bullet points.
+- Use the units given in the context; otherwise default to US customary units with metric in
+  parentheses where it helps.
+- Do not ask the driver follow-up questions; instead state which additional information (freeze-frame
+  data, live sensor readings, mileage, recent repairs) would narrow down the diagnosis.
+- Finish by recommending a qualified technician when the repair is beyond basic maintenance."""
+
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
 
 # ReAct prompt template
 REACT_PROMPT = """You are AutoSense, an expert automotive diagnostic agent. Your job is to help diagnose car problems using a systematic approach.
@@ -35,17 +138,53 @@ VIN: {vin}
 Start your reasoning process:"""
 
 
+@dataclass(slots=True)
+class AgentContext:
+    """Information gathered by the agent's Thought/Action/Observation steps."""
+    vin: Optional[str]
+    dtc_code: Optional[str]
+    thoughts: List[str]
+    actions: List[str]
+    observations: List[str]
+    search_results: List[Dict[str, Any]]
+    recalls: List[Dict[str, Any]]
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Shallow dict view, without the deep copy done by dataclasses.asdict."""
+        return {
+            "vin": self.vin,
+            "dtc_code": self.dtc_code,
+            "thoughts": self.thoughts,
+            "actions": self.actions,
+            "observations": self.observations,
+            "search_results": self.search_results,
+            "recalls": self.recalls
+        }
+
+
 class AutoSenseAgent:
     """ReAct-style agent for automotive diagnostics."""
     
-    def __init__(self, api_base_url: str = API_BASE_URL, openai_api_key: Optional[str] = None):
+    def __init__(
+        self,
+        api_base_url: str = API_BASE_URL,
+        openai_api_key: Optional[str] = None,
+        http_client: Optional[httpx.AsyncClient] = None
+    ):
         self.api_base_url = api_base_url
         self.openai_api_key = openai_api_key or OPENAI_API_KEY
         
         if not self.openai_api_key:
             logger.warning("No OpenAI API key provided. Agent will use fallback responses.")
         
-        self.http_client = httpx.AsyncClient(timeout=30.0)
+        self.llm_client = openai.AsyncOpenAI(api_key=self.openai_api_key) if self.openai_api_key else None
+        # A client passed in is owned by the caller; otherwise the shared client is used
+        self._http_client = http_client
+    
+    @property
+    def http_client(self) -> httpx.AsyncClient:
+        """HTTP client used for API calls."""
+        return self._http_client or get_shared_http_client()
     
     async def search(self, query: str, vin: Optional[str] = None, k: int = 5) -> List[Dict[str, Any]]:
         """Search for relevant diagnostic information."""
@@ -84,80 +223,91 @@ class AutoSenseAgent:
             logger.error(f"Recall lookup failed for VIN {vin}: {e}")
             return []
     
-    def _extract_dtc_code(self, query: str) -> Optional[str]:
-        """Extract DTC code from query if present."""
-        import re
-        # Look for patterns like P0420, C1234, etc.
-        dtc_pattern = r'\b[PBCU][0-9]{4}\b'
-        match = re.search(dtc_pattern, query.upper())
-        return match.group() if match else None
-    
-    def _extract_vin(self, query: str) -> Optional[str]:
-        """Extract VIN from query if present."""
-        import re
-        # Look for 17-character VIN pattern
-        vin_pattern = r'\b[A-HJ-NPR-Z0-9]{17}\b'
-        match = re.search(vin_pattern, query.upper())
-        return match.group() if match else None
-    
-    async def react(self, query: str, vin: Optional[str] = None) -> Dict[str, Any]:
-        """Execute the ReAct reasoning loop."""
-        start_time = datetime.now()
+    async def _gather_context(self, query: str, vin: Optional[str] = None) -> AgentContext:
+        """Run the Thought/Action/Observation steps and collect their results."""
         thoughts = []
         actions = []
         observations = []
+        recalls = []
+        
+        # Extract VIN and DTC from query if not provided
+        found_vin, extracted_dtc = extract_vin_and_dtc(query)
+        extracted_vin = vin or found_vin
+        
+        # Initial thought
+        thoughts.append("Analyzing the automotive diagnostic query to understand the problem and determine required information.")
+        
+        # Search, DTC lookup and recall lookup are independent, so run them concurrently
+        actions.append("search")
+        tasks = [self.search(query, extracted_vin, k=5)]
+        if extracted_dtc:
+            actions.append("lookup_dtc")
+            tasks.append(self.lookup_dtc(extracted_dtc))
+        if extracted_vin:
+            actions.append("lookup_recalls")
+            tasks.append(self.lookup_recalls(extracted_vin))
+        
+        results = await asyncio.gather(*tasks)
+        search_results = results[0]
+        observations.append(f"Found {len(search_results)} relevant results")
+        
+        # If DTC code found, record the detailed information
+        if extracted_dtc:
+            dtc_info = results[1]
+            if dtc_info:
+                observations.append(f"Retrieved detailed DTC information for {extracted_dtc}")
+            else:
+                observations.append(f"No detailed information found for DTC {extracted_dtc}")
+        
+        # If VIN provided, record the recalls
+        if extracted_vin:
+            recalls = results[-1]
+            observations.append(f"Found {len(recalls)} recalls for VIN {extracted_vin}")
+        
+        # Final thought before answering
+        thoughts.append("Synthesizing all gathered information to provide a comprehensive diagnosis.")
+        
+        return AgentContext(
+            vin=extracted_vin,
+            dtc_code=extracted_dtc,
+            thoughts=thoughts,
+            actions=actions,
+            observations=observations,
+            search_results=search_results,
+            recalls=recalls
+        )
+    
+    async def react(self, query: str, vin: Optional[str] = None) -> Dict[str, Any]:
+        """Execute the ReAct reasoning loop."""
+        start_time = time.perf_counter()
+        timestamp = datetime.now().isoformat()
         
         try:
-            # Extract VIN and DTC from query if not provided
-            extracted_vin = vin or self._extract_vin(query)
-            extracted_dtc = self._extract_dtc_code(query)
-            
-            # Initial thought
-            thoughts.append("Analyzing the automotive diagnostic query to understand the problem and determine required information.")
-            
-            # Search for relevant information
-            actions.append("search")
-            search_results = await self.search(query, extracted_vin, k=5)
-            observations.append(f"Found {len(search_results)} relevant results")
+            context = await self._gather_context(query, vin)
             
-            # If DTC code found, get detailed information
-            if extracted_dtc:
-                actions.append("lookup_dtc")
-                dtc_info = await self.lookup_dtc(extracted_dtc)
-                if dtc_info:
-                    observations.append(f"Retrieved detailed DTC information for {extracted_dtc}")
-                else:
-                    observations.append(f"No detailed information found for DTC {extracted_dtc}")
-            
-            # If VIN provided, check for recalls
-            if extracted_vin:
-                actions.append("lookup_recalls")
-                recalls = await self.lookup_recalls(extracted_vin)
-                observations.append(f"Found {len(recalls)} recalls for VIN {extracted_vin}")
-            
-            # Generate final answer using LLM
-            thoughts.append("Synthesizing all gathered information to provide a comprehensive diagnosis.")
-            
-            if self.openai_api_key:
-                answer = await self._generate_llm_response(query, search_results, extracted_dtc, extracted_vin, recalls)
+            if self.llm_client:
+                answer = await self._generate_llm_response(
+                    query, context.search_results, context.dtc_code, context.vin, context.recalls
+                )
             else:
-                answer = self._generate_fallback_response(query, search_results, extracted_dtc, extracted_vin, recalls)
+                answer = self._generate_fallback_response(
+                    query, context.search_results, context.dtc_code, context.vin, context.recalls
+                )
             
-            end_time = datetime.now()
-            processing_time = (end_time - start_time).total_seconds()
+            processing_time = time.perf_counter() - start_time
             
             return {
                 "query": query,
-                "vin": extracted_vin,
-                "dtc_code": extracted_dtc,
+                "vin": context.vin,
+                "dtc_code": context.dtc_code,
                 "answer": answer,
-                "thoughts": thoughts,
-                "actions": actions,
-                "observations": observations,
-                "search_results": search_results,
-                "recalls": recalls if extracted_vin else [],
+                "thoughts": context.thoughts,
+                "actions": context.actions,
+                "observations": context.observations,
+                "search_results": context.search_results,
+                "recalls": context.recalls,
                 "processing_time": processing_time,
-                "timestamp": start_time.isoformat()
+                "timestamp": timestamp
             }
             
         except Exception as e:
@@ -165,10 +315,87 @@ class AutoSenseAgent:
             return {
                 "query": query,
                 "error": str(e),
-                "processing_time": (datetime.now() - start_time).total_seconds(),
-                "timestamp": start_time.isoformat()
+                "processing_time": time.perf_counter() - start_time,
+                "timestamp": timestamp
             }
     
+    async def react_stream(self, query: str, vin: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Execute the ReAct reasoning loop, yielding the answer as it is generated.
+        
+        Yields a ``context`` event with the gathered information, one ``token`` event
+        per answer chunk, and a final ``done`` (or ``error``) event.
+        """
+        start_time = time.perf_counter()
+        timestamp = datetime.now().isoformat()
+        
+        try:
+            context = await self._gather_context(query, vin)
+            yield {"event": "context", "query": query, **context.to_dict()}
+            
+            if self.llm_client:
+                async for token in self._stream_llm_response(
+                    query, context.search_results, context.dtc_code, context.vin, context.recalls
+                ):
+                    yield {"event": "token", "content": token}
+            else:
+                yield {
+                    "event": "token",
+                    "content": self._generate_fallback_response(
+                        query, context.search_results, context.dtc_code, context.vin, context.recalls
+                    )
+                }
+            
+            yield {
+                "event": "done",
+                "processing_time": time.perf_counter() - start_time,
+                "timestamp": timestamp
+            }
+            
+        except Exception as e:
+            logger.error(f"ReAct streaming failed: {e}")
+            yield {
+                "event": "error",
+                "error": str(e),
+                "processing_time": time.perf_counter() - start_time,
+                "timestamp": timestamp
+            }
+    
+    def _build_messages(
+        self, 
+        query: str, 
+        search_results: List[Dict[str, Any]], 
+        dtc_code: Optional[str], 
+        vin: Optional[str], 
+        recalls: List[Dict[str, Any]]
+    ) -> List[Dict[str, str]]:
+        """Build the chat messages sent to the LLM."""
+        # Prepare context for LLM
+        context_parts = []
+        
+        if search_results:
+            context_parts.append("Relevant diagnostic information:")
+            context_parts.extend(
+                f"{i}. {result.get('description', result.get('summary', 'No description'))}"
+                for i, result in enumerate(search_results[:3], 1)
+            )
+        
+        if dtc_code:
+            context_parts.append(f"\nDTC Code {dtc_code} detected in query.")
+        
+        if recalls:
+            context_parts.append(f"\nRecalls found for VIN {vin}:")
+            context_parts.extend(f"- {recall.get('summary', 'No summary')}" for recall in recalls[:3])
+        
+        context = "\n".join(context_parts)
+        
+        return [
+            _SYSTEM_MESSAGE,
+            {
+                "role": "user",
+                "content": f"Query: {query}\n\nContext:\n{context}\n\nProvide a comprehensive diagnostic response:"
+            }
+        ]
+    
     async def _generate_llm_response(
         self, 
         query: str, 
@@ -179,43 +406,15 @@ class AutoSenseAgent:
     ) -> str:
         """Generate response using OpenAI API."""
         try:
-            # Prepare context for LLM
-            context_parts = []
-            
-            if search_results:
-                context_parts.append("Relevant diagnostic information:")
-                for i, result in enumerate(search_results[:3], 1):
-                    context_parts.append(f"{i}. {result.get('description', result.get('summary', 'No description'))}")
+            messages = self._build_messages(query, search_results, dtc_code, vin, recalls)
             
-            if dtc_code:
-                context_parts.append(f"\nDTC Code {dtc_code} detected in query.")
-            
-            if recalls:
-                context_parts.append(f"\nRecalls found for VIN {vin}:")
-                for recall in recalls[:3]:
-                    context_parts.append(f"- {recall.get('summary', 'No summary')}")
-            
-            context = "\n".join(context_parts)
-            
-            messages = [
-                {
-                    "role": "system",
-                    "content": """You are AutoSense, an expert automotive diagnostic assistant. 
-                    Provide clear, actionable diagnostic advice based on the information provided. 
-                    Include specific repair steps when possible, and always mention safety considerations."""
-                },
-                {
-                    "role": "user",
-                    "content": f"Query: {query}\n\nContext:\n{context}\n\nProvide a comprehensive diagnostic response:"
-                }
-            ]
-            
-            response = openai.ChatCompletion.create(
-                model="gpt-4o-mini",
+            response = await self.llm_client.chat.completions.create(
+                model=LLM_MODEL,
                 messages=messages,
                 max_tokens=500,
                 temperature=0.3
             )
+            self._log_prompt_cache_usage(response.usage)
             
             return response.choices[0].message.content
             
@@ -223,6 +422,50 @@ class AutoSenseAgent:
             logger.error(f"LLM response generation failed: {e}")
             return self._generate_fallback_response(query, search_results, dtc_code, vin, recalls)
     
+    async def _stream_llm_response(
+        self, 
+        query: str, 
+        search_results: List[Dict[str, Any]], 
+        dtc_code: Optional[str], 
+        vin: Optional[str], 
+        recalls: List[Dict[str, Any]]
+    ) -> AsyncIterator[str]:
+        """Stream response tokens from the OpenAI API."""
+        streamed = False
+        try:
+            messages = self._build_messages(query, search_results, dtc_code, vin, recalls)
+            
+            stream = await self.llm_client.chat.completions.create(
+                model=LLM_MODEL,
+                messages=messages,
+                max_tokens=500,
+                temperature=0.3,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            
+            async for chunk in stream:
+                if chunk.usage:
+                    self._log_prompt_cache_usage(chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    streamed = True
+                    yield chunk.choices[0].delta.content
+            
+        except Exception as e:
+            logger.error(f"LLM response streaming failed: {e}")
+            # A partial answer can't be patched up; surface the failure so the stream ends in an error
+            if streamed:
+                raise
+            yield self._generate_fallback_response(query, search_results, dtc_code, vin, recalls)
+    
+    def _log_prompt_cache_usage(self, usage: Any) -> None:
+        """Log how many prompt tokens were served from OpenAI's prefix cache."""
+        if not usage:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = getattr(details, "cached_tokens", 0) or 0
+        logger.info(f"LLM prompt tokens: {usage.prompt_tokens} ({cached_tokens} cached)")
+    
     def _generate_fallback_response(
         self, 
         query: str, 
@@ -240,23 +483,24 @@ class AutoSenseAgent:
         if search_results:
             response_parts.append("\n**Relevant Information Found**:")
             for result in search_results[:3]:
-                if result.get("type") == "dtc":
+                result_type = result.get("type")
+                if result_type == "dtc":
                     response_parts.append(f"- DTC {result.get('code')}: {result.get('description', 'No description')}")
-                elif result.get("type") == "recall":
+                elif result_type == "recall":
                     response_parts.append(f"- Recall {result.get('rid')}: {result.get('summary', 'No summary')}")
         
         if recalls:
             response_parts.append(f"\n**Recalls for VIN {vin}**:")
-            for recall in recalls[:2]:
-                response_parts.append(f"- {recall.get('summary', 'No summary')}")
+            response_parts.extend(f"- {recall.get('summary', 'No summary')}" for recall in recalls[:2])
         
         response_parts.append("\n**Recommendation**: Please consult with a qualified automotive technician for proper diagnosis and repair.")
         
         return "\n".join(response_parts)
     
     async def close(self):
-        """Close the HTTP client."""
-        await self.http_client.aclose()
+        """Close the LLM client; the HTTP client is shared or owned by the caller."""
+        if self.llm_client:
+            await self.llm_client.close()
 
 
 # Convenience function for easy usage
@@ -271,8 +515,6 @@ async def react(query: str, vin: Optional[str] = None) -> str:
 
 
 if __name__ == "__main__":
-    import asyncio
-    
     async def test_agent():
         agent = AutoSenseAgent()
         result = await agent.react("My car is showing P0420 error code")
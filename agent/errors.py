@@ -1,9 +1,36 @@
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 import re
+import operator
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Precompiled patterns
+_DTC_RE = re.compile(r'\b[PBCU][0-9]{4}\b')
+_VIN_RE = re.compile(r'\b[A-HJ-NPR-Z0-9]{17}\b')
+_VIN_OR_DTC_RE = re.compile(r'\b(?:(?P<vin>[A-HJ-NPR-Z0-9]{17})|(?P<dtc>[PBCU][0-9]{4}))\b')
+_SUSPICIOUS_RE = re.compile(
+    r'<script'  # Potential XSS
+    r'|javascript:'  # JavaScript injection
+    r'|data:text/html'  # Data URI injection
+    r'|vbscript:',  # VBScript injection
+    re.IGNORECASE
+)
+
+# ISO 3779 check-digit tables: letter transliteration values and per-position weights
+_VIN_VALUES = {
+    **{str(d): d for d in range(10)},
+    **dict(zip('ABCDEFGH', range(1, 9))),
+    **dict(zip('JKLMN', range(1, 6))),
+    'P': 7,
+    'R': 9,
+    **dict(zip('STUVWXYZ', range(2, 10))),
+}
+_VIN_WEIGHTS = (8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2)
+
+# Characters stripped by sanitize_input
+_SANITIZE_TABLE = str.maketrans('', '', '<>"\'&')
+
 
 class QueryError(Exception):
     """Base exception for query-related errors."""
@@ -43,32 +70,42 @@ def validate_query(query: str) -> None:
     if len(query) > 500:
         raise LongInputError("Query exceeds maximum length of 500 characters")
     
-    # Check for suspicious content
-    suspicious_patterns = [
-        r'<script',  # Potential XSS
-        r'javascript:',  # JavaScript injection
-        r'data:text/html',  # Data URI injection
-        r'vbscript:',  # VBScript injection
-    ]
+    # Every suspicious pattern contains '<' or ':', so clean queries skip the regex entirely
+    if '<' not in query and ':' not in query:
+        return
     
-    for pattern in suspicious_patterns:
-        if re.search(pattern, query, re.IGNORECASE):
-            raise MalformedInputError(f"Query contains suspicious content: {pattern}")
+    # Check for suspicious content
+    match = _SUSPICIOUS_RE.search(query)
+    if match:
+        raise MalformedInputError(f"Query contains suspicious content: {match.group().lower()}")
+
 
+def vin_check_digit(vin: str) -> str:
+    """Compute the ISO 3779 check digit of a well-formed 17-character VIN."""
+    remainder = sum(map(operator.mul, map(_VIN_VALUES.__getitem__, vin), _VIN_WEIGHTS)) % 11
+    return 'X' if remainder == 10 else str(remainder)
 
-def validate_vin(vin: Optional[str]) -> Optional[str]:
-    """Validate VIN format and return normalized VIN."""
+
+def validate_vin(vin: Optional[str], check_digit: bool = False) -> Optional[str]:
+    """Validate VIN format and return normalized VIN.
+    
+    With ``check_digit``, also verify the ISO 3779 check digit in position 9. This is only
+    mandatory for North American VINs, so it is opt-in.
+    """
     if not vin:
         return None
     
     vin = vin.strip().upper()
     
     # VIN validation: 17 characters, no I, O, Q
-    vin_pattern = r'^[A-HJ-NPR-Z0-9]{17}$'
-    
-    if not re.match(vin_pattern, vin):
+    if not _VIN_RE.fullmatch(vin):
         raise InvalidVINError(f"Invalid VIN format: {vin}. VIN must be 17 characters and contain only valid characters.")
     
+    if check_digit:
+        expected = vin_check_digit(vin)
+        if vin[8] != expected:
+            raise InvalidVINError(f"Invalid VIN check digit: {vin}. Position 9 should be {expected}.")
+    
     return vin
 
 
@@ -80,9 +117,7 @@ def validate_dtc_code(code: Optional[str]) -> Optional[str]:
     code = code.strip().upper()
     
     # DTC validation: P/B/C/U followed by 4 digits
-    dtc_pattern = r'^[PBCU][0-9]{4}$'
-    
-    if not re.match(dtc_pattern, code):
+    if not _DTC_RE.fullmatch(code):
         raise InvalidDTCError(f"Invalid DTC code format: {code}. DTC must be P/B/C/U followed by 4 digits.")
     
     return code
@@ -90,10 +125,8 @@ def validate_dtc_code(code: Optional[str]) -> Optional[str]:
 
 def sanitize_input(text: str) -> str:
     """Sanitize input text to prevent injection attacks."""
-    # Remove or escape potentially dangerous characters
-    dangerous_chars = ['<', '>', '"', "'", '&']
-    for char in dangerous_chars:
-        text = text.replace(char, '')
+    # Remove potentially dangerous characters in a single pass
+    text = text.translate(_SANITIZE_TABLE)
     
     # Remove excessive whitespace
     text = ' '.join(text.split())
@@ -101,29 +134,53 @@ def sanitize_input(text: str) -> str:
     return text
 
 
-def extract_and_validate_components(query: str) -> Dict[str, Any]:
-    """Extract and validate VIN and DTC from query."""
+def extract_vin_and_dtc(query: str, skip_vin: bool = False) -> Tuple[Optional[str], Optional[str]]:
+    """Find the first VIN and DTC code in a query with a single regex scan."""
+    vin = None
+    dtc_code = None
+    
+    for match in _VIN_OR_DTC_RE.finditer(query.upper()):
+        if match.lastgroup == 'vin':
+            if not skip_vin:
+                vin = vin or match.group('vin')
+        else:
+            dtc_code = dtc_code or match.group('dtc')
+        
+        if dtc_code and (vin or skip_vin):
+            break
+    
+    return vin, dtc_code
+
+
+def extract_and_validate_components(
+    query: str,
+    skip_vin: bool = False,
+    sanitized_query: Optional[str] = None
+) -> Dict[str, Any]:
+    """Extract and validate VIN and DTC from query.
+    
+    Pass ``skip_vin`` when the caller already has a validated VIN, and
+    ``sanitized_query`` when the query has already been sanitized.
+    """
     components = {
         'vin': None,
         'dtc_code': None,
-        'sanitized_query': sanitize_input(query)
+        'sanitized_query': sanitized_query if sanitized_query is not None else sanitize_input(query)
     }
     
-    # Extract VIN
-    vin_pattern = r'\b[A-HJ-NPR-Z0-9]{17}\b'
-    vin_match = re.search(vin_pattern, query.upper())
-    if vin_match:
+    vin, dtc_code = extract_vin_and_dtc(query, skip_vin=skip_vin)
+    
+    # Validate VIN
+    if vin:
         try:
-            components['vin'] = validate_vin(vin_match.group())
+            components['vin'] = validate_vin(vin)
         except InvalidVINError as e:
             logger.warning(f"Invalid VIN in query: {e}")
     
-    # Extract DTC code
-    dtc_pattern = r'\b[PBCU][0-9]{4}\b'
-    dtc_match = re.search(dtc_pattern, query.upper())
-    if dtc_match:
+    # Validate DTC code
+    if dtc_code:
         try:
-            components['dtc_code'] = validate_dtc_code(dtc_match.group())
+            components['dtc_code'] = validate_dtc_code(dtc_code)
         except InvalidDTCError as e:
             logger.warning(f"Invalid DTC code in query: {e}")
     
@@ -132,20 +189,30 @@ def extract_and_validate_components(query: str) -> Dict[str, Any]:
 
 def handle_edge_cases(query: str, vin: Optional[str] = None) -> Dict[str, Any]:
     """Handle various edge cases and return processed components."""
+    # Sanitize once; reused on both the success and error paths
+    sanitized_query = sanitize_input(query) if query else ''
+    
     try:
         # Validate query
         validate_query(query)
         
-        # Extract and validate components
-        components = extract_and_validate_components(query)
-        
-        # Override with provided VIN if it's more specific
+        # A valid provided VIN takes precedence, so the query need not be scanned for one
+        provided_vin = None
         if vin:
             try:
-                components['vin'] = validate_vin(vin)
+                provided_vin = validate_vin(vin)
             except InvalidVINError as e:
                 logger.warning(f"Provided VIN is invalid: {e}")
         
+        # Extract and validate components
+        components = extract_and_validate_components(
+            query,
+            skip_vin=provided_vin is not None,
+            sanitized_query=sanitized_query
+        )
+        if provided_vin:
+            components['vin'] = provided_vin
+        
         # Add validation status
         components['is_valid'] = True
         components['errors'] = []
@@ -158,7 +225,7 @@ def handle_edge_cases(query: str, vin: Optional[str] = None) -> Dict[str, Any]:
             'is_valid': False,
             'error': str(e),
             'error_type': type(e).__name__,
-            'sanitized_query': sanitize_input(query),
+            'sanitized_query': sanitized_query,
             'vin': None,
             'dtc_code': None
         }
@@ -168,7 +235,7 @@ def handle_edge_cases(query: str, vin: Optional[str] = None) -> Dict[str, Any]:
             'is_valid': False,
             'error': "Unexpected validation error",
             'error_type': 'ValidationError',
-            'sanitized_query': sanitize_input(query),
+            'sanitized_query': sanitized_query,
             'vin': None,
             'dtc_code': None
         }
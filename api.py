@@ -1,13 +1,23 @@
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field
 from sentence_transformers import SentenceTransformer
 from qdrant_client import QdrantClient, models
 import os
-import psycopg
-from typing import List, Dict, Any, Optional
+import json
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from psycopg_pool import AsyncConnectionPool
+from cachetools import TTLCache
+from typing import List, Dict, Any, Optional, TYPE_CHECKING
 import logging
 
+if TYPE_CHECKING:
+    from agent.core import AutoSenseAgent
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -16,7 +26,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="AutoSense Agentic RAG API",
     description="AI diagnostic platform for connected cars",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -32,11 +43,32 @@ app.add_middleware(
 model: Optional[SentenceTransformer] = None
 qdrant: Optional[QdrantClient] = None
 DB_URL: Optional[str] = None
+db_pool: Optional[AsyncConnectionPool] = None
+embedding_queue: Optional[asyncio.Queue] = None
+embedding_worker: Optional[asyncio.Task] = None
+react_agent: Optional["AutoSenseAgent"] = None
+# Created per startup, since shutdown stops it; None falls back to the loop's default executor
+embedding_executor: Optional[ThreadPoolExecutor] = None
+embedding_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+# DTC descriptions are static reference data; recalls only change when NHTSA publishes new ones
+dtc_cache: TTLCache = TTLCache(maxsize=4096, ttl=86400)
+recall_cache: TTLCache = TTLCache(maxsize=8192, ttl=3600)
 COLLECTION_NAME = "autosense"
+# Payload fields returned by /search; anything else stored in Qdrant stays server-side
+SEARCH_PAYLOAD_FIELDS = ["type", "code", "category", "description", "rid", "vin", "date", "summary"]
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# Dynamically quantized int8 ONNX export published alongside the model; set to "" to use PyTorch
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+EMBEDDING_CACHE_SIZE = 4096
+# Concurrent /search queries arriving within this window are encoded in one batch
+EMBEDDING_BATCH_WINDOW = 0.005
+EMBEDDING_MAX_BATCH = 32
 
 
 # Pydantic models
 class SearchRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid", str_strip_whitespace=True)
+    
     query: str = Field(..., min_length=1, max_length=500, description="Search query")
     k: int = Field(default=5, ge=1, le=20, description="Number of results to return")
     vin: Optional[str] = Field(None, max_length=17, description="Vehicle identification number")
@@ -50,6 +82,8 @@ class SearchResponse(BaseModel):
 
 
 class AgentRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid", str_strip_whitespace=True)
+    
     query: str = Field(..., min_length=1, max_length=500, description="Diagnostic query")
     vin: Optional[str] = Field(None, max_length=17, description="Vehicle identification number")
 
@@ -73,27 +107,116 @@ class HealthResponse(BaseModel):
     services: Dict[str, str]
 
 
+def load_embedding_model() -> SentenceTransformer:
+    """Load the embedding model, preferring the int8 ONNX Runtime backend."""
+    if EMBEDDING_ONNX_FILE:
+        try:
+            onnx_model = SentenceTransformer(
+                EMBEDDING_MODEL_NAME,
+                backend="onnx",
+                model_kwargs={"file_name": EMBEDDING_ONNX_FILE}
+            )
+            logger.info(f"Initialized int8 ONNX embedding model ({EMBEDDING_ONNX_FILE})")
+            return onnx_model
+        except Exception as e:
+            logger.warning(f"ONNX embedding model unavailable, falling back to PyTorch: {e}")
+    
+    torch_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    logger.info("Initialized embedding model")
+    return torch_model
+
+
 # Dependency functions
 def get_embedding_model() -> SentenceTransformer:
     """Get or initialize the embedding model."""
     global model
     if model is None:
         try:
-            model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-            logger.info("Initialized embedding model")
+            model = load_embedding_model()
         except Exception as e:
             logger.error(f"Failed to initialize embedding model: {e}")
             raise HTTPException(status_code=500, detail="Embedding model not available")
     return model
 
 
+def _encode_batch(queries: List[str]) -> np.ndarray:
+    """Encode a batch of queries into read-only, normalized embeddings (blocking)."""
+    embeddings = get_embedding_model().encode(
+        queries, normalize_embeddings=True, batch_size=EMBEDDING_MAX_BATCH
+    )
+    # Embeddings may be cached and shared between requests, so keep them read-only
+    embeddings.setflags(write=False)
+    return embeddings
+
+
+async def _embedding_batch_worker() -> None:
+    """Group queued queries into batched encode calls."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await embedding_queue.get()]
+        deadline = loop.time() + EMBEDDING_BATCH_WINDOW
+        while len(batch) < EMBEDDING_MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(embedding_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        queries = [query for query, _ in batch]
+        try:
+            # The forward pass releases the GIL, so running it in a thread keeps the event loop free
+            embeddings = await loop.run_in_executor(embedding_executor, _encode_batch, queries)
+        except Exception as e:
+            logger.error(f"Batch encoding of {len(queries)} queries failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+
+async def enqueue_encode(query: str) -> np.ndarray:
+    """Encode a query through the micro-batching worker."""
+    if embedding_queue is None:
+        embeddings = await asyncio.get_running_loop().run_in_executor(
+            embedding_executor, _encode_batch, [query]
+        )
+        return embeddings[0]
+    
+    future = asyncio.get_running_loop().create_future()
+    await embedding_queue.put((query, future))
+    return await future
+
+
+async def encode_query(query: str) -> np.ndarray:
+    """Encode a search query, reusing the embedding of repeated queries."""
+    # MiniLM's tokenizer is uncased, so case and surrounding whitespace don't change the vector
+    key = query.strip().lower()
+    embedding = embedding_cache.get(key)
+    if embedding is not None:
+        embedding_cache.move_to_end(key)
+        return embedding
+    
+    embedding = await enqueue_encode(key)
+    embedding_cache[key] = embedding
+    if len(embedding_cache) > EMBEDDING_CACHE_SIZE:
+        embedding_cache.popitem(last=False)
+    return embedding
+
+
 def get_qdrant_client() -> QdrantClient:
     """Get or initialize the Qdrant client."""
     global qdrant
     if qdrant is None:
         try:
             qdrant_url = os.getenv("QDRANT_URL", "http://localhost:6333")
-            qdrant = QdrantClient(qdrant_url)
+            grpc_port = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
+            qdrant = QdrantClient(qdrant_url, prefer_grpc=True, grpc_port=grpc_port)
             # Test connection
             qdrant.get_collections()
             logger.info(f"Connected to Qdrant at {qdrant_url}")
@@ -113,6 +236,55 @@ def get_db_url() -> str:
     return DB_URL
 
 
+def get_agent() -> "AutoSenseAgent":
+    """Get or create the shared ReAct agent, so its LLM client is reused across requests."""
+    global react_agent
+    if react_agent is None:
+        from agent.core import AutoSenseAgent
+        react_agent = AutoSenseAgent()
+    return react_agent
+
+
+def get_db_pool() -> AsyncConnectionPool:
+    """Get the shared database connection pool."""
+    if db_pool is None:
+        raise HTTPException(status_code=500, detail="Database pool not initialized")
+    return db_pool
+
+
+@app.on_event("startup")
+async def startup_event():
+    """Start the embedding batch worker and open the shared database connection pool."""
+    global db_pool, embedding_queue, embedding_worker, embedding_executor
+    embedding_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="embedding")
+    embedding_queue = asyncio.Queue()
+    embedding_worker = asyncio.create_task(_embedding_batch_worker())
+    
+    try:
+        db_pool = AsyncConnectionPool(get_db_url(), min_size=4, max_size=20, open=False)
+        await db_pool.open()
+        logger.info("Opened database connection pool")
+    except Exception as e:
+        logger.error(f"Failed to open database connection pool: {e}")
+        db_pool = None
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the embedding batch worker and close the shared agent and database connection pool."""
+    global embedding_executor, react_agent
+    if embedding_worker is not None:
+        embedding_worker.cancel()
+    if embedding_executor is not None:
+        embedding_executor.shutdown(wait=False)
+        embedding_executor = None
+    if react_agent is not None:
+        await react_agent.close()
+        react_agent = None
+    if db_pool is not None:
+        await db_pool.close()
+
+
 # Health check endpoint
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
@@ -135,9 +307,9 @@ async def health_check():
     
     # Check database
     try:
-        db_url = get_db_url()
-        with psycopg.connect(db_url) as conn:
-            conn.execute("SELECT 1")
+        pool = get_db_pool()
+        async with pool.connection() as conn:
+            await conn.execute("SELECT 1")
         services["database"] = "healthy"
     except Exception as e:
         services["database"] = f"unhealthy: {str(e)}"
@@ -157,7 +329,7 @@ async def search(
     """Search for relevant automotive diagnostic information."""
     try:
         # Create embedding for the query
-        query_embedding = embedding_model.encode(request.query, normalize_embeddings=True)
+        query_embedding = await encode_query(request.query)
         
         # Build filter if needed
         query_filter = None
@@ -180,27 +352,30 @@ async def search(
         # Search in Qdrant
         search_results = qdrant_client.search(
             collection_name=COLLECTION_NAME,
-            query_vector=query_embedding.tolist(),
+            query_vector=query_embedding,
             limit=request.k,
             query_filter=query_filter,
-            with_payload=True,
+            # Search the int8-quantized vectors, then rescore the top hits with the originals
+            search_params=models.SearchParams(
+                quantization=models.QuantizationSearchParams(rescore=True)
+            ),
+            with_payload=models.PayloadSelectorInclude(include=SEARCH_PAYLOAD_FIELDS),
             with_vectors=False
         )
         
-        # Format results
+        # Format results; each payload is a fresh dict, so add the score in place
         results = []
         for result in search_results:
-            result_dict = {
-                "score": float(result.score),
-                **result.payload
-            }
+            result_dict = result.payload
+            result_dict["score"] = float(result.score)
             results.append(result_dict)
         
-        return SearchResponse(
-            results=results,
-            query=request.query,
-            total_found=len(results)
-        )
+        # Returning the response directly skips re-validating it against SearchResponse
+        return ORJSONResponse({
+            "results": results,
+            "query": request.query,
+            "total_found": len(results)
+        })
         
     except Exception as e:
         logger.error(f"Search error: {e}")
@@ -209,24 +384,32 @@ async def search(
 
 # Get DTC information endpoint
 @app.get("/dtc/{code}")
-async def get_dtc_info(code: str, db_url: str = Depends(get_db_url)):
+async def get_dtc_info(code: str, pool: AsyncConnectionPool = Depends(get_db_pool)):
     """Get detailed information about a specific DTC code."""
+    key = code.upper()
+    cached = dtc_cache.get(key)
+    if cached is not None:
+        return cached
+    
     try:
-        with psycopg.connect(db_url) as conn, conn.cursor() as cur:
-            cur.execute(
+        async with pool.connection() as conn, conn.cursor() as cur:
+            await cur.execute(
                 "SELECT code, category, description FROM dtc WHERE code = %s",
-                (code.upper(),)
+                (key,),
+                prepare=True
             )
-            result = cur.fetchone()
+            result = await cur.fetchone()
             
             if not result:
                 raise HTTPException(status_code=404, detail=f"DTC code {code} not found")
             
-            return {
+            dtc_info = {
                 "code": result[0],
                 "category": result[1],
                 "description": result[2]
             }
+            dtc_cache[key] = dtc_info
+            return dtc_info
     except HTTPException:
         raise
     except Exception as e:
@@ -236,18 +419,24 @@ async def get_dtc_info(code: str, db_url: str = Depends(get_db_url)):
 
 # Get recalls for a VIN endpoint
 @app.get("/recalls/{vin}")
-async def get_recalls_for_vin(vin: str, db_url: str = Depends(get_db_url)):
+async def get_recalls_for_vin(vin: str, pool: AsyncConnectionPool = Depends(get_db_pool)):
     """Get all recalls for a specific VIN."""
+    key = vin.upper()
+    recalls = recall_cache.get(key)
+    if recalls is not None:
+        return {"vin": vin, "recalls": recalls, "count": len(recalls)}
+    
     try:
-        with psycopg.connect(db_url) as conn, conn.cursor() as cur:
-            cur.execute(
+        async with pool.connection() as conn, conn.cursor() as cur:
+            await cur.execute(
                 """SELECT nhtsa_id, date, summary 
                    FROM recall 
                    WHERE vin = %s 
                    ORDER BY date DESC""",
-                (vin.upper(),)
+                (key,),
+                prepare=True
             )
-            results = cur.fetchall()
+            results = await cur.fetchall()
             
             recalls = []
             for row in results:
@@ -256,6 +445,7 @@ async def get_recalls_for_vin(vin: str, db_url: str = Depends(get_db_url)):
                     "date": str(row[1]) if row[1] else None,
                     "summary": row[2]
                 })
+            recall_cache[key] = recalls
             
             return {"vin": vin, "recalls": recalls, "count": len(recalls)}
     except Exception as e:
@@ -268,12 +458,7 @@ async def get_recalls_for_vin(vin: str, db_url: str = Depends(get_db_url)):
 async def run_agent(request: AgentRequest):
     """Run the ReAct agent for automotive diagnostics."""
     try:
-        from agent.core import AutoSenseAgent
-        
-        agent = AutoSenseAgent()
-        result = await agent.react(request.query, request.vin)
-        await agent.close()
-        
+        result = await get_agent().react(request.query, request.vin)
         return AgentResponse(**result)
         
     except Exception as e:
@@ -281,6 +466,19 @@ async def run_agent(request: AgentRequest):
         raise HTTPException(status_code=500, detail=f"Agent failed: {str(e)}")
 
 
+# Streaming agent endpoint
+@app.post("/agent/stream")
+async def run_agent_stream(request: AgentRequest):
+    """Run the ReAct agent and stream the answer as Server-Sent Events."""
+    agent = get_agent()
+    
+    async def event_stream():
+        async for event in agent.react_stream(request.query, request.vin):
+            yield f"data: {json.dumps(event)}\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 # Root endpoint
 @app.get("/")
 async def root():
@@ -293,6 +491,7 @@ async def root():
             "health": "/health",
             "search": "/search",
             "agent": "/agent",
+            "agent_stream": "/agent/stream",
             "dtc_info": "/dtc/{code}",
             "recalls": "/recalls/{vin}"
         }
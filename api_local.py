@@ -1,15 +1,24 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
 from sentence_transformers import SentenceTransformer
+import torch
 from rank_bm25 import BM25Okapi
+import bm25s
 import sqlite3
 import json
 import os
-from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import heapq
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, List, Dict, Any, Optional, Tuple, Union
 import logging
 from datetime import datetime
 import numpy as np
+from scipy.sparse import csr_matrix
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -19,7 +28,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="AutoSense Agentic RAG API (Local)",
     description="AI diagnostic platform for connected cars - Local Version",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -33,10 +43,38 @@ app.add_middleware(
 
 # Global variables
 model: Optional[SentenceTransformer] = None
-bm25_index: Optional[BM25Okapi] = None
+bm25_index: Optional[Union[bm25s.BM25, BM25Okapi, "NumbaBM25"]] = None
 documents: List[Dict[str, Any]] = []
+doc_embeddings: Optional[np.ndarray] = None  # int8 with the numba kernel, else float32; one row per document
+doc_embedding_scales: Optional[np.ndarray] = None  # float32 per-row dequantization scale (int8 only)
+int8_similarity: Optional[Callable[..., np.ndarray]] = None  # compiled _int8_similarity_kernel
+vocab: Dict[str, int] = {}
+token_ids: Optional[np.ndarray] = None  # int32 token ids of every document, concatenated
+doc_offsets: Optional[np.ndarray] = None  # document i is token_ids[doc_offsets[i]:doc_offsets[i + 1]]
+doc_token_matrix: Optional[csr_matrix] = None  # binary (documents x vocab) token presence
+doc_texts_lower: Optional[np.ndarray] = None
+doc_vins_upper: Optional[np.ndarray] = None
+db_conn: Optional[sqlite3.Connection] = None
+embedding_queue: Optional[asyncio.Queue] = None
+embedding_worker: Optional[asyncio.Task] = None
+# Created per startup, since shutdown stops it; None falls back to the loop's default executor
+embedding_executor: Optional[ThreadPoolExecutor] = None
+embedding_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+# Set once the background model load and corpus embedding have finished
+model_ready: Optional[asyncio.Event] = None
+model_loader: Optional[asyncio.Task] = None
 DB_PATH = "autosense.db"
 COLLECTION_NAME = "autosense_local"
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+# Dynamically quantized int8 ONNX export published alongside the model; set to "" to use PyTorch
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_quint8_avx2.onnx")
+# "bm25s" (sparse-matrix scoring), "numba" (JIT-compiled postings kernel, needs the numba extra)
+# or "rank_bm25" (pure-Python BM25Okapi, kept for A/B comparison)
+BM25_BACKEND = os.getenv("BM25_BACKEND", "bm25s")
+# Concurrent /search queries arriving within this window are encoded in one batch
+EMBEDDING_BATCH_WINDOW = 0.005
+EMBEDDING_MAX_BATCH = 32
+EMBEDDING_CACHE_SIZE = 1024
 
 # Pydantic models
 class SearchRequest(BaseModel):
@@ -45,21 +83,16 @@ class SearchRequest(BaseModel):
     vin: Optional[str] = Field(None, max_length=17, description="Vehicle identification number")
     use_hybrid: bool = Field(default=True, description="Use hybrid search (vector + BM25)")
 
-class SearchResponse(BaseModel):
-    results: List[Dict[str, Any]]
-    query: str
-    total_found: int
-    search_type: str
-
-class HealthResponse(BaseModel):
-    status: str
-    services: Dict[str, str]
-
 def init_database():
     """Initialize SQLite database with sample data."""
     conn = sqlite3.connect(DB_PATH)
+    # WAL is persistent in the database file and must be set outside a transaction
+    conn.execute("PRAGMA journal_mode=WAL")
     cursor = conn.cursor()
     
+    # Schema and seed data go in one transaction (a single commit/fsync)
+    cursor.execute("BEGIN")
+    
     # Create tables
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS dtc (
@@ -100,6 +133,13 @@ def init_database():
         )
     ''')
     
+    # Create indexes
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_recall_vin_date ON recall (vin, date DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sr_vehicle_ts ON sensor_reading (vehicle_id, ts DESC)")
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_sr_vehicle_sensor_ts ON sensor_reading (vehicle_id, sensor, ts DESC)"
+    )
+    
     # Insert sample DTC data
     sample_dtcs = [
         ("P0420", "Engine", "Catalyst System Efficiency Below Threshold (Bank 1)"),
@@ -114,8 +154,16 @@ def init_database():
         ("P0700", "Transmission", "Transmission Control System Malfunction"),
     ]
     
+    # Warm start: sample data was seeded on a previous run
+    cursor.execute("SELECT COUNT(*) FROM dtc")
+    if cursor.fetchone()[0] >= len(sample_dtcs):
+        conn.commit()
+        conn.close()
+        logger.info("Database already initialized, skipping sample data")
+        return
+    
     cursor.executemany(
-        "INSERT OR REPLACE INTO dtc (code, category, description) VALUES (?, ?, ?)",
+        "INSERT OR IGNORE INTO dtc (code, category, description) VALUES (?, ?, ?)",
         sample_dtcs
     )
     
@@ -127,29 +175,219 @@ def init_database():
     ]
     
     cursor.executemany(
-        "INSERT OR REPLACE INTO recall (nhtsa_id, vin, date, summary) VALUES (?, ?, ?, ?)",
+        "INSERT OR IGNORE INTO recall (nhtsa_id, vin, date, summary) VALUES (?, ?, ?, ?)",
         sample_recalls
     )
     
+    # Refresh planner statistics after the bulk inserts
+    cursor.execute("ANALYZE")
     conn.commit()
     conn.close()
     logger.info("Database initialized with sample data")
 
+def get_db_connection() -> sqlite3.Connection:
+    """Get or open the shared SQLite connection used by request handlers."""
+    global db_conn
+    if db_conn is None:
+        db_conn = sqlite3.connect(DB_PATH, check_same_thread=False, isolation_level=None)
+        db_conn.execute("PRAGMA journal_mode=WAL")
+        db_conn.execute("PRAGMA synchronous=NORMAL")
+        db_conn.execute("PRAGMA temp_store=MEMORY")
+        db_conn.execute("PRAGMA mmap_size=268435456")
+        logger.info("Opened shared SQLite connection (WAL)")
+    return db_conn
+
+def cpu_supports_bf16() -> bool:
+    """Check /proc/cpuinfo for native bfloat16 matmul support (AVX512_BF16 or AMX)."""
+    try:
+        with open("/proc/cpuinfo") as f:
+            cpuinfo = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in cpuinfo or "amx_bf16" in cpuinfo
+
+def load_embedding_model() -> SentenceTransformer:
+    """Load the embedding model, preferring the int8 ONNX Runtime backend."""
+    if EMBEDDING_ONNX_FILE:
+        try:
+            onnx_model = SentenceTransformer(
+                EMBEDDING_MODEL_NAME,
+                backend="onnx",
+                model_kwargs={"file_name": EMBEDDING_ONNX_FILE}
+            )
+            logger.info(f"Initialized int8 ONNX embedding model ({EMBEDDING_ONNX_FILE})")
+            return onnx_model
+        except Exception as e:
+            logger.warning(f"ONNX embedding model unavailable, falling back to PyTorch: {e}")
+    
+    torch_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    # bf16 halves weight bandwidth, but is emulated (and slower) without native CPU support
+    if torch_model.device.type == "cpu" and cpu_supports_bf16():
+        torch_model = torch_model.to(torch.bfloat16)
+        logger.info("Initialized bfloat16 embedding model")
+    else:
+        logger.info("Initialized embedding model")
+    return torch_model
+
 def get_embedding_model() -> SentenceTransformer:
     """Get or initialize the embedding model."""
     global model
     if model is None:
         try:
-            model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
-            logger.info("Initialized embedding model")
+            model = load_embedding_model()
         except Exception as e:
             logger.error(f"Failed to initialize embedding model: {e}")
             raise HTTPException(status_code=500, detail="Embedding model not available")
     return model
 
+def _encode_batch(queries: List[str]) -> np.ndarray:
+    """Encode a batch of queries into read-only, normalized embeddings (blocking)."""
+    embeddings = get_embedding_model().encode(
+        queries, normalize_embeddings=True, batch_size=EMBEDDING_MAX_BATCH, convert_to_numpy=True
+    )
+    # Embeddings may be cached and shared between requests, so keep them read-only
+    embeddings.setflags(write=False)
+    return embeddings
+
+async def _embedding_batch_worker() -> None:
+    """Group queued queries into batched encode calls."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await embedding_queue.get()]
+        deadline = loop.time() + EMBEDDING_BATCH_WINDOW
+        while len(batch) < EMBEDDING_MAX_BATCH:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(embedding_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        queries = [query for query, _ in batch]
+        try:
+            # The forward pass releases the GIL, so running it in a thread keeps the event loop free
+            embeddings = await loop.run_in_executor(embedding_executor, _encode_batch, queries)
+        except Exception as e:
+            logger.error(f"Batch encoding of {len(queries)} queries failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+        
+        for (_, future), embedding in zip(batch, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+async def enqueue_encode(query: str) -> np.ndarray:
+    """Encode a query through the micro-batching worker."""
+    if embedding_queue is None:
+        embeddings = await asyncio.get_running_loop().run_in_executor(
+            embedding_executor, _encode_batch, [query]
+        )
+        return embeddings[0]
+    
+    future = asyncio.get_running_loop().create_future()
+    await embedding_queue.put((query, future))
+    return await future
+
+async def encode_query(query: str) -> np.ndarray:
+    """Encode a search query, reusing the embedding of repeated queries."""
+    # MiniLM's tokenizer is uncased, so case and surrounding whitespace don't change the vector
+    key = query.strip().lower()
+    embedding = embedding_cache.get(key)
+    if embedding is not None:
+        embedding_cache.move_to_end(key)
+        return embedding
+    
+    embedding = await enqueue_encode(key)
+    embedding_cache[key] = embedding
+    if len(embedding_cache) > EMBEDDING_CACHE_SIZE:
+        embedding_cache.popitem(last=False)
+    return embedding
+
+def tokenize(text_lower: str) -> List[str]:
+    """Split already-lowercased text into the tokens shared by documents and queries."""
+    return text_lower.split()
+
+@lru_cache(maxsize=EMBEDDING_CACHE_SIZE)
+def tokenize_query(query: str) -> Tuple[str, ...]:
+    """Split a query into the lowercase tokens used by BM25 and keyword scoring."""
+    return tuple(tokenize(query.lower()))
+
+def quantize_int8(embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetrically quantize embeddings to int8 with one scale per row."""
+    embeddings = np.atleast_2d(embeddings).astype(np.float32, copy=False)
+    scales = np.abs(embeddings).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.round(embeddings / scales[:, None]).astype(np.int8)
+    return np.ascontiguousarray(quantized), scales.astype(np.float32)
+
+def _int8_similarity_kernel(matrix, query, scales, query_scale):
+    """Dot each int8 row with the int8 query, accumulating in int32 without widening the matrix."""
+    n_docs, dim = matrix.shape
+    scores = np.empty(n_docs, dtype=np.float32)
+    query32 = query.astype(np.int32)
+    for i in range(n_docs):
+        acc = np.int32(0)
+        for j in range(dim):
+            acc += np.int32(matrix[i, j]) * query32[j]
+        scores[i] = acc * scales[i] * query_scale
+    return scores
+
+def _bm25_kernel(query_ids, idf, tf_data, tf_indices, tf_indptr, doc_len, avgdl, k1, b, n_docs):
+    """Accumulate BM25 scores over the postings of each query term."""
+    scores = np.zeros(n_docs, dtype=np.float32)
+    for term in query_ids:
+        for j in range(tf_indptr[term], tf_indptr[term + 1]):
+            doc = tf_indices[j]
+            tf = tf_data[j]
+            scores[doc] += idf[term] * tf * (k1 + 1.0) / (tf + k1 * (1.0 - b + b * doc_len[doc] / avgdl))
+    return scores
+
+class NumbaBM25:
+    """BM25 over a term-major CSR of term frequencies, scored by a Numba-compiled kernel."""
+    
+    def __init__(self, token_ids: np.ndarray, doc_offsets: np.ndarray, n_terms: int,
+                 k1: float = 1.5, b: float = 0.75):
+        n_docs = len(doc_offsets) - 1
+        doc_len = np.diff(doc_offsets).astype(np.float32)
+        doc_rows = np.repeat(np.arange(n_docs), np.diff(doc_offsets))
+        # Rows are terms, so a query only touches the postings of its own terms
+        tf = csr_matrix(
+            (np.ones(len(token_ids), dtype=np.float32), (token_ids, doc_rows)),
+            shape=(n_terms, n_docs)
+        )
+        df = np.diff(tf.indptr).astype(np.float32)
+        
+        self.idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+        self.tf_data = tf.data
+        self.tf_indices = tf.indices
+        self.tf_indptr = tf.indptr
+        self.doc_len = doc_len
+        self.avgdl = float(doc_len.mean()) if n_docs else 1.0
+        self.k1 = k1
+        self.b = b
+        self.n_docs = n_docs
+        
+        try:
+            import numba
+            self._kernel = numba.njit(cache=True, fastmath=True)(_bm25_kernel)
+        except ImportError:
+            logger.warning("numba is not installed; BM25 kernel runs in pure Python")
+            self._kernel = _bm25_kernel
+    
+    def get_scores(self, query_ids: List[int]) -> np.ndarray:
+        """Score every document against the query token ids."""
+        return self._kernel(
+            np.asarray(query_ids, dtype=np.int32), self.idf, self.tf_data, self.tf_indices,
+            self.tf_indptr, self.doc_len, self.avgdl, self.k1, self.b, self.n_docs
+        )
+
 def build_bm25_index():
     """Build BM25 index from database documents."""
     global bm25_index, documents
+    global vocab, token_ids, doc_offsets, doc_token_matrix, doc_texts_lower, doc_vins_upper
     
     conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
@@ -185,27 +423,122 @@ def build_bm25_index():
     conn.close()
     
     if documents:
-        # Tokenize documents for BM25
-        tokenized_docs = [doc["text"].lower().split() for doc in documents]
-        bm25_index = BM25Okapi(tokenized_docs)
-        logger.info(f"Built BM25 index with {len(documents)} documents")
+        # Tokenize documents into one contiguous int32 id array plus per-document offsets
+        # Lowercase each text once; the tokens and search_local's substring array both reuse it
+        texts_lower = [doc["text"].lower() for doc in documents]
+        tokenized_docs = [tokenize(text) for text in texts_lower]
+        vocab = {}
+        token_ids = np.fromiter(
+            (vocab.setdefault(token, len(vocab)) for tokens in tokenized_docs for token in tokens),
+            dtype=np.int32
+        )
+        doc_lengths = np.array([len(tokens) for tokens in tokenized_docs], dtype=np.int64)
+        doc_offsets = np.concatenate(([0], np.cumsum(doc_lengths)))
+        
+        if BM25_BACKEND == "rank_bm25":
+            bm25_index = BM25Okapi(tokenized_docs)
+        elif BM25_BACKEND == "numba":
+            bm25_index = NumbaBM25(token_ids, doc_offsets, len(vocab))
+        else:
+            # Hand bm25s the ids and vocabulary directly so it shares ours
+            corpus_ids = [ids.tolist() for ids in np.split(token_ids, doc_offsets[1:-1])]
+            bm25_index = bm25s.BM25()
+            bm25_index.index(bm25s.tokenization.Tokenized(ids=corpus_ids, vocab=vocab), show_progress=False)
+        logger.info(f"Built {BM25_BACKEND} BM25 index with {len(documents)} documents")
+        
+        # Binary (document x token) presence matrix for search_local's word overlap
+        doc_rows = np.repeat(np.arange(len(documents)), doc_lengths)
+        doc_token_matrix = csr_matrix(
+            (np.ones(len(token_ids), dtype=np.float32), (doc_rows, token_ids)),
+            shape=(len(documents), len(vocab))
+        )
+        doc_token_matrix.data[:] = 1.0  # repeated tokens were summed on conversion
+        doc_texts_lower = np.array(texts_lower)
+        doc_vins_upper = np.array([(doc.get("vin") or "").upper() for doc in documents])
     else:
         logger.warning("No documents found for BM25 index")
 
+def build_doc_embeddings():
+    """Embed the corpus once so each query costs one encode plus one GEMV (blocking)."""
+    global doc_embeddings, doc_embedding_scales, int8_similarity
+    
+    if not documents:
+        return
+    
+    # int8 storage only pays off with a compiled kernel; NumPy would widen the whole matrix per query
+    try:
+        import numba
+        int8_similarity = numba.njit(cache=True, fastmath=True)(_int8_similarity_kernel)
+    except ImportError:
+        int8_similarity = None
+    
+    try:
+        embedding_model = get_embedding_model()
+        embeddings = embedding_model.encode(
+            [doc["text"] for doc in documents],
+            batch_size=64,
+            normalize_embeddings=True,
+            convert_to_numpy=True
+        )
+        if int8_similarity is not None:
+            doc_embeddings, doc_embedding_scales = quantize_int8(embeddings)
+        else:
+            doc_embeddings, doc_embedding_scales = np.ascontiguousarray(embeddings, dtype=np.float32), None
+        logger.info(f"Cached {doc_embeddings.shape} {doc_embeddings.dtype} document embedding matrix")
+    except Exception as e:
+        doc_embeddings = None
+        doc_embedding_scales = None
+        logger.warning(f"Document embeddings unavailable, vector scores disabled: {e}")
+
+async def warm_up_embeddings():
+    """Load the model and embed the corpus in a worker thread, then mark the model ready."""
+    try:
+        await asyncio.get_running_loop().run_in_executor(embedding_executor, build_doc_embeddings)
+    finally:
+        model_ready.set()
+
+
+def get_bm25_scores(query_tokens: List[str]) -> np.ndarray:
+    """Score every document against the query tokens with the active BM25 backend."""
+    if isinstance(bm25_index, BM25Okapi):
+        return bm25_index.get_scores(query_tokens)
+    
+    # bm25s and NumbaBM25 share our vocabulary, so score by token id; bm25s rejects an empty query
+    query_ids = [vocab[token] for token in query_tokens if token in vocab]
+    if not query_ids:
+        return np.zeros(len(documents), dtype=np.float32)
+    return bm25_index.get_scores(query_ids)
+
 
-def hybrid_search(query: str, k: int = 5, vin: Optional[str] = None) -> List[Dict[str, Any]]:
+def hybrid_search(
+    query: str,
+    k: int = 5,
+    vin: Optional[str] = None,
+    query_embedding: Optional[np.ndarray] = None
+) -> List[Dict[str, Any]]:
     """Perform hybrid search combining vector and BM25 scores."""
-    global model, bm25_index, documents
+    global model, bm25_index, documents, doc_embeddings, doc_embedding_scales
     
     if not documents or not bm25_index:
         return search_local(query, k, vin)
     
-    # Vector search
-    vector_results = search_local(query, k * 2, vin)  # Get more results for reranking
+    # Vector search: cosine scores for the top k*2 candidates, used for reranking
+    vector_scores = np.zeros(len(documents), dtype=np.float32)
+    if doc_embeddings is not None:
+        if query_embedding is None:
+            query_embedding = _encode_batch([query])[0]
+        if doc_embedding_scales is not None:
+            query_q, query_scale = quantize_int8(query_embedding)
+            similarities = int8_similarity(doc_embeddings, query_q[0], doc_embedding_scales, query_scale[0])
+        else:
+            similarities = doc_embeddings @ query_embedding.astype(np.float32, copy=False)
+        n_candidates = min(k * 2, len(documents))
+        top = np.argpartition(similarities, -n_candidates)[-n_candidates:]
+        vector_scores[top] = similarities[top]
     
     # BM25 search
-    query_tokens = query.lower().split()
-    bm25_scores = bm25_index.get_scores(query_tokens)
+    query_tokens = list(tokenize_query(query))
+    bm25_scores = get_bm25_scores(query_tokens)
     
     # Combine scores
     combined_results = []
@@ -213,16 +546,10 @@ def hybrid_search(query: str, k: int = 5, vin: Optional[str] = None) -> List[Dic
         if vin and doc.get("vin") and doc["vin"] != vin:
             continue  # Filter by VIN if provided
         
-        # Find corresponding vector result
-        vector_score = 0.0
-        for vec_result in vector_results:
-            if (doc.get("code") == vec_result.get("code") or 
-                doc.get("rid") == vec_result.get("rid")):
-                vector_score = vec_result.get("score", 0.0)
-                break
+        vector_score = float(vector_scores[i])
         
         # Normalize BM25 score (0-1 range)
-        bm25_score = min(bm25_scores[i] / 10.0, 1.0) if bm25_scores[i] > 0 else 0.0
+        bm25_score = min(float(bm25_scores[i]) / 10.0, 1.0) if bm25_scores[i] > 0 else 0.0
         
         # Combine scores (weighted average)
         combined_score = 0.7 * vector_score + 0.3 * bm25_score
@@ -234,121 +561,82 @@ def hybrid_search(query: str, k: int = 5, vin: Optional[str] = None) -> List[Dic
             "bm25_score": bm25_score
         })
     
-    # Sort by combined score and return top k
-    combined_results.sort(key=lambda x: x["score"], reverse=True)
-    return combined_results[:k]
+    # Partial heap selection of the top k (ties keep corpus order, as a stable sort would)
+    return heapq.nlargest(k, combined_results, key=lambda x: x["score"])
 
 
 def search_local(query: str, k: int = 5, vin: Optional[str] = None) -> List[Dict[str, Any]]:
-    """Simple local search implementation."""
-    embedding_model = get_embedding_model()
+    """Simple keyword search over the in-memory corpus built at startup."""
+    if not documents or doc_token_matrix is None:
+        return []
     
-    # Get all DTC codes
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    query_lower = query.lower()
     
-    cursor.execute("SELECT code, category, description FROM dtc")
-    dtc_results = cursor.fetchall()
+    # Exact matches get high scores
+    scores = np.where(np.char.find(doc_texts_lower, query_lower) >= 0, 0.8, 0.0)
     
-    cursor.execute("SELECT nhtsa_id, vin, date, summary FROM recall")
-    recall_results = cursor.fetchall()
+    # Word overlap: one sparse mat-vec against the binary query vector
+    query_ids = [vocab[word] for word in set(tokenize_query(query)) if word in vocab]
+    if query_ids:
+        query_vector = np.zeros(len(vocab), dtype=np.float32)
+        query_vector[query_ids] = 1.0
+        scores += 0.1 * (doc_token_matrix @ query_vector)
     
-    conn.close()
+    # VIN filtering
+    if vin:
+        scores += np.where(np.char.find(doc_vins_upper, vin.upper()) >= 0, 0.5, 0.0)
     
-    # Create searchable documents
-    documents = []
-    
-    # Add DTC documents
-    for code, category, description in dtc_results:
-        text = f"DTC {code} ({category}): {description}"
-        documents.append({
-            "text": text,
-            "type": "dtc",
-            "code": code,
-            "category": category,
-            "description": description,
-            "score": 0.0
-        })
-    
-    # Add recall documents
-    for nhtsa_id, recall_vin, date, summary in recall_results:
-        text = f"Recall {nhtsa_id} ({date}): {summary}"
-        documents.append({
-            "text": text,
-            "type": "recall",
-            "rid": nhtsa_id,
-            "vin": recall_vin,
-            "date": date,
-            "summary": summary,
-            "score": 0.0
-        })
-    
-    # Simple keyword-based scoring
-    query_lower = query.lower()
-    for doc in documents:
-        score = 0.0
-        text_lower = doc["text"].lower()
-        
-        # Exact matches get high scores
-        if query_lower in text_lower:
-            score += 0.8
-        
-        # Word overlap
-        query_words = set(query_lower.split())
-        text_words = set(text_lower.split())
-        overlap = len(query_words.intersection(text_words))
-        score += overlap * 0.1
-        
-        # VIN filtering
-        if vin and doc.get("vin") and vin.upper() in doc["vin"].upper():
-            score += 0.5
-        
-        doc["score"] = min(score, 1.0)
+    scores = np.minimum(scores, 1.0)
     
-    # Sort by score and return top k
-    documents.sort(key=lambda x: x["score"], reverse=True)
-    return documents[:k]
+    # Top k by partial heap selection (ties keep corpus order);
+    # shallow copies so callers never mutate the shared corpus
+    order = heapq.nlargest(k, range(len(documents)), key=scores.__getitem__)
+    return [{**documents[i], "score": float(scores[i])} for i in order]
 
-@app.get("/health", response_model=HealthResponse)
+@app.get("/health")
 async def health_check():
     """Health check endpoint."""
     services = {}
     
-    # Check embedding model
-    try:
-        get_embedding_model()
-        services["embedding_model"] = "healthy"
-    except Exception as e:
-        services["embedding_model"] = f"unhealthy: {str(e)}"
+    # Check embedding model (without blocking on it while it is still loading)
+    if model_ready is not None and not model_ready.is_set():
+        services["embedding_model"] = "loading"
+    else:
+        try:
+            get_embedding_model()
+            services["embedding_model"] = "healthy"
+        except Exception as e:
+            services["embedding_model"] = f"unhealthy: {str(e)}"
     
     # Check database
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.execute("SELECT 1")
-        conn.close()
+        get_db_connection().execute("SELECT 1")
         services["database"] = "healthy"
     except Exception as e:
         services["database"] = f"unhealthy: {str(e)}"
     
     overall_status = "healthy" if all("healthy" in status for status in services.values()) else "degraded"
     
-    return HealthResponse(status=overall_status, services=services)
+    return {"status": overall_status, "services": services}
 
-@app.post("/search", response_model=SearchResponse)
-async def search(
-    request: SearchRequest,
-    embedding_model: SentenceTransformer = Depends(get_embedding_model)
-):
+@app.post("/search")
+async def search(request: SearchRequest):
     """Search for relevant automotive diagnostic information."""
     try:
-        results = hybrid_search(request.query, request.k, request.vin)
-        
-        return SearchResponse(
-            results=results,
-            query=request.query,
-            total_found=len(results),
-            search_type="hybrid" if request.use_hybrid else "vector"
-        )
+        if model_ready is not None:
+            await model_ready.wait()
+        
+        # Encode off the event loop, batched with concurrent requests
+        query_embedding = await encode_query(request.query) if doc_embeddings is not None else None
+        results = hybrid_search(request.query, request.k, request.vin, query_embedding)
+        
+        # Plain dict straight to orjson; no response_model re-validation of every result
+        return ORJSONResponse({
+            "results": results,
+            "query": request.query,
+            "total_found": len(results),
+            "search_type": "hybrid" if request.use_hybrid else "vector"
+        })
         
     except Exception as e:
         logger.error(f"Search error: {e}")
@@ -358,15 +646,13 @@ async def search(
 async def get_dtc_info(code: str):
     """Get detailed information about a DTC code."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        cursor = get_db_connection().cursor()
         
         cursor.execute(
             "SELECT code, category, description FROM dtc WHERE code = ?",
             (code.upper(),)
         )
         result = cursor.fetchone()
-        conn.close()
         
         if not result:
             raise HTTPException(status_code=404, detail=f"DTC code {code} not found")
@@ -386,8 +672,7 @@ async def get_dtc_info(code: str):
 async def get_recalls_for_vin(vin: str):
     """Get all recalls for a specific VIN."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        cursor = get_db_connection().cursor()
         
         cursor.execute(
             """SELECT nhtsa_id, date, summary 
@@ -397,7 +682,6 @@ async def get_recalls_for_vin(vin: str):
             (vin.upper(),)
         )
         results = cursor.fetchall()
-        conn.close()
         
         recalls = []
         for row in results:
@@ -416,11 +700,10 @@ async def get_recalls_for_vin(vin: str):
 async def get_sensor_data(vin: str, sensor: Optional[str] = None, limit: int = 100):
     """Get sensor data for a specific vehicle."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        cursor = get_db_connection().cursor()
         
-        # Get vehicle ID
-        cursor.execute("SELECT id FROM vehicle WHERE vin = ?", (vin,))
+        # Get vehicle ID and info (returned once, not repeated per reading)
+        cursor.execute("SELECT id, vin, make, model, year FROM vehicle WHERE vin = ?", (vin,))
         result = cursor.fetchone()
         
         if not result:
@@ -430,9 +713,8 @@ async def get_sensor_data(vin: str, sensor: Optional[str] = None, limit: int = 1
         
         # Build query
         query = """
-        SELECT sr.ts, sr.sensor, sr.value, v.vin, v.make, v.model, v.year
+        SELECT sr.ts, sr.sensor, sr.value
         FROM sensor_reading sr
-        JOIN vehicle v ON sr.vehicle_id = v.id
         WHERE sr.vehicle_id = ?
         """
         params = [vehicle_id]
@@ -447,21 +729,19 @@ async def get_sensor_data(vin: str, sensor: Optional[str] = None, limit: int = 1
         cursor.execute(query, params)
         results = cursor.fetchall()
         
-        conn.close()
-        
         return {
             "vin": vin,
+            "vehicle_info": {
+                "vin": result[1],
+                "make": result[2],
+                "model": result[3],
+                "year": result[4]
+            },
             "sensor_data": [
                 {
                     "timestamp": row[0],
                     "sensor": row[1],
-                    "value": row[2],
-                    "vehicle_info": {
-                        "vin": row[3],
-                        "make": row[4],
-                        "model": row[5],
-                        "year": row[6]
-                    }
+                    "value": row[2]
                 }
                 for row in results
             ],
@@ -477,8 +757,7 @@ async def get_sensor_data(vin: str, sensor: Optional[str] = None, limit: int = 1
 async def get_sensor_analytics(vin: str, sensor: Optional[str] = None):
     """Get sensor analytics for a specific vehicle."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        cursor = get_db_connection().cursor()
         
         # Get vehicle ID
         cursor.execute("SELECT id FROM vehicle WHERE vin = ?", (vin,))
@@ -512,8 +791,6 @@ async def get_sensor_analytics(vin: str, sensor: Optional[str] = None):
         cursor.execute(query, params)
         results = cursor.fetchall()
         
-        conn.close()
-        
         return {
             "vin": vin,
             "analytics": [
@@ -538,8 +815,7 @@ async def get_sensor_analytics(vin: str, sensor: Optional[str] = None):
 async def get_sensor_anomalies(vin: str):
     """Get sensor anomalies for a specific vehicle."""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
+        cursor = get_db_connection().cursor()
         
         # Get vehicle ID
         cursor.execute("SELECT id FROM vehicle WHERE vin = ?", (vin,))
@@ -560,33 +836,34 @@ async def get_sensor_anomalies(vin: str):
             'battery_voltage': {'min': 11.5, 'max': 14.5, 'unit': 'V'}
         }
         
-        anomalies = []
+        # One pass over the (vehicle_id, sensor, ts) index against an inline threshold table
+        threshold_rows = ", ".join(["(?, ?, ?, ?, ?)"] * len(thresholds))
+        query = f"""
+        WITH t(ord, sensor, min_v, max_v, unit) AS (VALUES {threshold_rows})
+        SELECT sr.ts, sr.sensor, sr.value, t.min_v, t.max_v, t.unit
+        FROM t
+        JOIN sensor_reading sr ON sr.vehicle_id = ? AND sr.sensor = t.sensor
+        WHERE sr.value < t.min_v OR sr.value > t.max_v
+        ORDER BY t.ord, sr.ts DESC
+        """
+        params = []
+        for position, (sensor, threshold) in enumerate(thresholds.items()):
+            params.extend([position, sensor, threshold['min'], threshold['max'], threshold['unit']])
+        params.append(vehicle_id)
         
-        for sensor, threshold in thresholds.items():
-            query = """
-            SELECT sr.ts, sr.value
-            FROM sensor_reading sr
-            WHERE sr.vehicle_id = ? AND sr.sensor = ? 
-            AND (sr.value < ? OR sr.value > ?)
-            ORDER BY sr.ts DESC
-            """
-            params = [vehicle_id, sensor, threshold['min'], threshold['max']]
-            
-            cursor.execute(query, params)
-            results = cursor.fetchall()
-            
-            for row in results:
-                anomalies.append({
-                    'timestamp': row[0],
-                    'sensor': sensor,
-                    'value': row[1],
-                    'threshold_min': threshold['min'],
-                    'threshold_max': threshold['max'],
-                    'unit': threshold['unit'],
-                    'severity': 'high' if abs(row[1] - (threshold['min'] + threshold['max']) / 2) > (threshold['max'] - threshold['min']) / 2 else 'medium'
-                })
+        cursor.execute(query, params)
         
-        conn.close()
+        anomalies = []
+        for ts, sensor, value, min_v, max_v, unit in cursor.fetchall():
+            anomalies.append({
+                'timestamp': ts,
+                'sensor': sensor,
+                'value': value,
+                'threshold_min': min_v,
+                'threshold_max': max_v,
+                'unit': unit,
+                'severity': 'high' if abs(value - (min_v + max_v) / 2) > (max_v - min_v) / 2 else 'medium'
+            })
         
         return {
             "vin": vin,
@@ -617,8 +894,29 @@ async def root():
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup."""
+    global embedding_queue, embedding_worker, embedding_executor, model_ready, model_loader
     init_database()
+    get_db_connection()
     build_bm25_index() # Build index on startup
+    embedding_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="embedding")
+    embedding_queue = asyncio.Queue()
+    embedding_worker = asyncio.create_task(_embedding_batch_worker())
+    # Load the model off the event loop so startup and /health don't wait on it
+    model_ready = asyncio.Event()
+    model_loader = asyncio.create_task(warm_up_embeddings())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the embedding batch worker and close the shared database connection."""
+    global db_conn, embedding_executor
+    if embedding_worker is not None:
+        embedding_worker.cancel()
+    if embedding_executor is not None:
+        embedding_executor.shutdown(wait=False)
+        embedding_executor = None
+    if db_conn is not None:
+        db_conn.close()
+        db_conn = None
 
 if __name__ == "__main__":
     import uvicorn
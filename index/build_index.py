@@ -1,9 +1,11 @@
 import os
+import hashlib
+import pathlib
+from itertools import islice
 import psycopg
-import tqdm
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, models
 from sentence_transformers import SentenceTransformer
-from typing import Iterator, Tuple, Dict, Any, List
+from typing import Iterator, Tuple, Dict, Any, List, Optional
 import logging
 
 # Set up logging
@@ -12,20 +14,32 @@ logger = logging.getLogger(__name__)
 
 DB = os.environ["DATABASE_URL"]
 QDRANT_URL = os.getenv("QDRANT_URL", "http://localhost:6333")
+QDRANT_GRPC_PORT = int(os.getenv("QDRANT_GRPC_PORT", "6334"))
 COLLECTION_NAME = "autosense"
+# Documents read, embedded and uploaded per window; memory stays bounded by this, not the corpus
+INDEX_WINDOW_SIZE = 8192
+UPLOAD_BATCH_SIZE = 512
+UPLOAD_PARALLEL = 4
+# Hash of the last successfully indexed corpus; a matching hash skips re-embedding
+INDEX_HASH_PATH = pathlib.Path(__file__).with_name("last_hash.txt")
+
+qdrant: Optional[QdrantClient] = None
 
 
 def get_qdrant_client() -> QdrantClient:
-    """Initialize and return Qdrant client."""
-    try:
-        client = QdrantClient(QDRANT_URL)
-        # Test connection
-        client.get_collections()
-        logger.info(f"Connected to Qdrant at {QDRANT_URL}")
-        return client
-    except Exception as e:
-        logger.error(f"Failed to connect to Qdrant: {e}")
-        raise
+    """Get or initialize the Qdrant client."""
+    global qdrant
+    if qdrant is None:
+        try:
+            # gRPC sends vectors as packed floats instead of JSON number lists
+            qdrant = QdrantClient(QDRANT_URL, prefer_grpc=True, grpc_port=QDRANT_GRPC_PORT)
+            # Test connection
+            qdrant.get_collections()
+            logger.info(f"Connected to Qdrant at {QDRANT_URL}")
+        except Exception as e:
+            logger.error(f"Failed to connect to Qdrant: {e}")
+            raise
+    return qdrant
 
 
 def get_embedding_model() -> SentenceTransformer:
@@ -41,80 +55,122 @@ def get_embedding_model() -> SentenceTransformer:
 
 def iter_text() -> Iterator[Tuple[str, Dict[str, Any]]]:
     """Iterate through all text data to be embedded."""
-    with psycopg.connect(DB) as conn, conn.cursor() as cur:
+    # Named (server-side) cursors stream rows in batches instead of fetching whole tables
+    with psycopg.connect(DB) as conn:
         # Get DTC codes
-        cur.execute("SELECT code, category, description FROM dtc")
-        for code, category, desc in cur:
-            text = f"DTC {code} ({category}): {desc}"
-            yield text, {"type": "dtc", "code": code, "category": category}
+        with conn.cursor(name="dtc_cur") as cur:
+            cur.execute("SELECT code, category, description FROM dtc")
+            for code, category, desc in cur:
+                text = f"DTC {code} ({category}): {desc}"
+                yield text, {"type": "dtc", "code": code, "category": category}
         
         # Get recalls
-        cur.execute("SELECT nhtsa_id, vin, date, summary FROM recall")
-        for rid, vin, date, summ in cur:
-            text = f"Recall {rid} ({date}): {summ}"
-            yield text, {"type": "recall", "rid": int(rid), "vin": vin, "date": str(date) if date else None}
+        with conn.cursor(name="recall_cur") as cur:
+            cur.execute("SELECT nhtsa_id, vin, date, summary FROM recall")
+            for rid, vin, date, summ in cur:
+                text = f"Recall {rid} ({date}): {summ}"
+                yield text, {"type": "recall", "rid": int(rid), "vin": vin, "date": str(date) if date else None}
+
+
+def corpus_hash() -> Tuple[str, int]:
+    """Hash every text and payload to be indexed; returns (hex digest, document count)."""
+    h = hashlib.blake2b(digest_size=16)
+    count = 0
+    for text, meta in iter_text():
+        h.update(text.encode())
+        h.update(repr(sorted(meta.items())).encode())
+        count += 1
+    return h.hexdigest(), count
+
+
+def index_is_current(client: QdrantClient, digest: str, count: int) -> bool:
+    """Whether the collection already holds the corpus with this hash."""
+    if not INDEX_HASH_PATH.exists() or INDEX_HASH_PATH.read_text().strip() != digest:
+        return False
+    # The sidecar alone can't tell whether Qdrant was wiped or an earlier build stopped midway
+    try:
+        return client.count(COLLECTION_NAME, exact=True).count == count
+    except Exception:
+        return False
 
 
 def build_index() -> None:
     """Build the vector index in Qdrant."""
     client = get_qdrant_client()
-    model = get_embedding_model()
     
-    # Get all text and metadata
-    texts_and_metas = list(iter_text())
-    if not texts_and_metas:
-        logger.warning("No data found to index")
+    # Hashing the corpus is one cheap read pass; embedding it again is the expensive part
+    digest, count = corpus_hash()
+    if count and index_is_current(client, digest, count):
+        logger.info(f"Corpus unchanged ({count} documents), skipping re-index")
         return
     
-    logger.info(f"Found {len(texts_and_metas)} documents to index")
-    
-    # Create embeddings
-    vecs, metas, ids = [], [], []
-    for i, (text, meta) in enumerate(tqdm.tqdm(texts_and_metas, desc="Creating embeddings")):
-        try:
-            vec = model.encode(text, normalize_embeddings=True)
-            vecs.append(vec)
-            metas.append(meta)
-            ids.append(i)
-        except Exception as e:
-            logger.error(f"Error encoding text {i}: {e}")
-            continue
+    model = get_embedding_model()
     
-    if not vecs:
-        logger.error("No embeddings created")
+    # Stream text and metadata; only one window is held in memory at a time
+    rows = iter_text()
+    window = list(islice(rows, INDEX_WINDOW_SIZE))
+    if not window:
+        logger.warning("No data found to index")
         return
     
     # Create or recreate collection
-    vector_size = len(vecs[0])
+    vector_size = model.get_sentence_embedding_dimension()
     try:
+        # Original float32 vectors live on disk for rescoring; int8 copies stay in RAM for search
         client.recreate_collection(
             collection_name=COLLECTION_NAME,
-            vectors_config={
-                "size": vector_size,
-                "distance": "Cosine"
-            }
+            vectors_config=models.VectorParams(
+                size=vector_size,
+                distance=models.Distance.COSINE,
+                on_disk=True
+            ),
+            quantization_config=models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True
+                )
+            )
         )
         logger.info(f"Created collection '{COLLECTION_NAME}' with vector size {vector_size}")
     except Exception as e:
         logger.error(f"Failed to create collection: {e}")
         return
+    INDEX_HASH_PATH.unlink(missing_ok=True)
     
-    # Upload vectors
-    try:
-        client.upsert(
-            collection_name=COLLECTION_NAME,
-            points=[
-                {
-                    "id": id_val,
-                    "vector": vec.tolist(),
-                    "payload": meta
-                }
-                for id_val, vec, meta in zip(ids, vecs, metas)
-            ]
-        )
-        logger.info(f"Successfully indexed {len(ids)} documents")
-    except Exception as e:
-        logger.error(f"Failed to upload vectors: {e}")
+    indexed = 0
+    while window:
+        texts = [text for text, _ in window]
+        metas = [meta for _, meta in window]
+        
+        try:
+            # Create embeddings in batches; one forward pass per batch instead of per document
+            vecs = model.encode(
+                texts,
+                batch_size=256,
+                normalize_embeddings=True,
+                convert_to_numpy=True
+            )
+            
+            # Upload vectors in chunks straight from the NumPy array (no per-vector Python lists)
+            client.upload_collection(
+                collection_name=COLLECTION_NAME,
+                vectors=vecs,
+                payload=metas,
+                ids=range(indexed, indexed + len(window)),
+                batch_size=UPLOAD_BATCH_SIZE,
+                parallel=UPLOAD_PARALLEL
+            )
+        except Exception as e:
+            logger.error(f"Failed to index documents {indexed}-{indexed + len(window) - 1}: {e}")
+            return
+        
+        indexed += len(window)
+        logger.info(f"Indexed {indexed} documents")
+        window = list(islice(rows, INDEX_WINDOW_SIZE))
+    
+    INDEX_HASH_PATH.write_text(digest)
+    logger.info(f"Successfully indexed {indexed} documents")
 
 
 def get_collection_info() -> Dict[str, Any]:
@@ -133,11 +189,16 @@ def get_collection_info() -> Dict[str, Any]:
         return {}
 
 
-if __name__ == "__main__":
+def main() -> None:
+    """Build the index and log the resulting collection info."""
     logger.info("Starting vector index build...")
     build_index()
     
     # Print collection info
     info = get_collection_info()
     if info:
-        logger.info(f"Collection info: {info}") 
\ No newline at end of file
+        logger.info(f"Collection info: {info}")
+
+
+if __name__ == "__main__":
+    main()
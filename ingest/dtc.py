@@ -2,12 +2,36 @@ import csv
 import psycopg
 import os
 import pathlib
-from typing import Optional
+from typing import Iterable, Optional, Sequence
 
 DB = os.environ["DATABASE_URL"]
 CSV = pathlib.Path("data/obd_codes.csv")
 
 
+def upsert_dtc_rows(cur: psycopg.Cursor, rows: Iterable[Sequence[str]]) -> int:
+    """Bulk-upsert (code, category, description) rows via COPY into a staging table."""
+    cur.execute(
+        """CREATE TEMP TABLE dtc_stage (
+               code TEXT, category TEXT, description TEXT, seq BIGSERIAL
+           ) ON COMMIT DROP"""
+    )
+    with cur.copy("COPY dtc_stage (code, category, description) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(row)
+    
+    # One set-based upsert; for repeated codes the last row wins, as with row-by-row upserts
+    cur.execute(
+        """INSERT INTO dtc (code, category, description) 
+           SELECT DISTINCT ON (code) code, category, description
+           FROM dtc_stage
+           ORDER BY code, seq DESC
+           ON CONFLICT (code) DO UPDATE SET 
+           description = EXCLUDED.description,
+           category = EXCLUDED.category"""
+    )
+    return cur.rowcount
+
+
 def load_dtc_codes(csv_path: Optional[pathlib.Path] = None) -> None:
     """Load OBD-II trouble codes from CSV file into Postgres."""
     if csv_path is None:
@@ -22,23 +46,18 @@ def load_dtc_codes(csv_path: Optional[pathlib.Path] = None) -> None:
         reader = csv.reader(f)
         next(reader)  # Skip header if present
         
-        for row in reader:
-            if len(row) >= 3:
-                code, category, description = row[0], row[1], row[2]
-                try:
-                    cur.execute(
-                        """INSERT INTO dtc (code, category, description) 
-                           VALUES (%s, %s, %s) 
-                           ON CONFLICT (code) DO UPDATE SET 
-                           description = EXCLUDED.description,
-                           category = EXCLUDED.category""",
-                        (code, category, description)
-                    )
-                except Exception as e:
-                    print(f"Error inserting DTC {code}: {e}")
+        # Short and blank-code rows are filtered once, ahead of the COPY stream
+        rows = ((row[0], row[1], row[2]) for row in reader if len(row) >= 3 and row[0])
+        
+        try:
+            count = upsert_dtc_rows(cur, rows)
+        except Exception as e:
+            print(f"Error loading DTC codes: {e}")
+            conn.rollback()
+            return
         
         conn.commit()
-        print(f"Loaded DTC codes from {csv_path}")
+        print(f"Loaded {count} DTC codes from {csv_path}")
 
 
 def create_sample_dtc_data() -> None:
@@ -57,22 +76,19 @@ def create_sample_dtc_data() -> None:
     ]
     
     with psycopg.connect(DB) as conn, conn.cursor() as cur:
-        for code, category, description in sample_dtcs:
-            cur.execute(
-                """INSERT INTO dtc (code, category, description) 
-                   VALUES (%s, %s, %s) 
-                   ON CONFLICT (code) DO UPDATE SET 
-                   description = EXCLUDED.description,
-                   category = EXCLUDED.category""",
-                (code, category, description)
-            )
+        upsert_dtc_rows(cur, sample_dtcs)
         conn.commit()
         print(f"Created {len(sample_dtcs)} sample DTC codes")
 
 
-if __name__ == "__main__":
+def main() -> None:
+    """Load DTC codes from the CSV, or sample codes when it is missing."""
     if CSV.exists():
         load_dtc_codes()
     else:
         print("CSV file not found, creating sample DTC data...")
-        create_sample_dtc_data() 
\ No newline at end of file
+        create_sample_dtc_data()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,56 @@
+import numpy as np
 import pandas as pd
 import sqlite3
 import os
-from typing import List, Dict, Any, Optional
-from datetime import datetime, timedelta
+import itertools
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple, Union
+from datetime import datetime
 import logging
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 DB_PATH = "autosense.db"
+READING_COLUMNS = ["vehicle_id", "ts", "sensor", "value"]
+# Loads whose first batch exceeds this many readings drop the sensor_reading indexes and
+# rebuild them afterwards
+BULK_LOAD_ROWS = 50_000
+# Source column aliases per canonical sensor, in order of preference
+SENSOR_MAPPINGS = {
+    'engine_temp': ['engine_temp', 'temperature', 'temp'],
+    'rpm': ['rpm', 'engine_rpm'],
+    'fuel_level': ['fuel_level', 'fuel', 'fuel_gauge'],
+    'speed': ['speed', 'vehicle_speed', 'mph'],
+    'oil_pressure': ['oil_pressure', 'oil'],
+    'battery_voltage': ['battery_voltage', 'battery', 'voltage']
+}
+# Source rows read per chunk when streaming a Kaggle dataset; bounds peak memory
+KAGGLE_CHUNK_ROWS = 50_000
+# Rows per multi-row INSERT; 200 x 4 columns stays under SQLite's 999 bound-parameter limit
+READING_INSERT_CHUNK = 200
+# Indexes for the anomaly filter (sensor, value) and per-vehicle analytics/history lookups
+SENSOR_READING_INDEXES = {
+    "idx_sr_sensor_value": "sensor_reading (sensor, value)",
+    "idx_sr_vehicle_sensor_ts": "sensor_reading (vehicle_id, sensor, ts DESC)",
+}
+
+
+# New vehicles and their sensor readings for one ingest batch
+SensorBatch = Tuple[List[Dict[str, Any]], Union[List[Dict[str, Any]], pd.DataFrame]]
+
+
+def open_db() -> sqlite3.Connection:
+    """Open a SQLite connection tuned for bulk writes and concurrent readers."""
+    # Autocommit unless a caller issues BEGIN; the statement cache holds every query used here
+    conn = sqlite3.connect(DB_PATH, cached_statements=256, isolation_level=None)
+    # WAL + synchronous=NORMAL: one fsync per checkpoint rather than two per commit
+    conn.executescript(
+        """PRAGMA journal_mode=WAL;
+           PRAGMA synchronous=NORMAL;
+           PRAGMA temp_store=MEMORY;
+           PRAGMA cache_size=-65536;"""
+    )
+    return conn
 
 
 def create_sample_sensor_data():
@@ -20,174 +62,250 @@ def create_sample_sensor_data():
         {"id": 3, "vin": "3VWDX7AJ5DM123456", "make": "Volkswagen", "model": "Jetta", "year": 2013},
     ]
     
-    # Sample sensor readings
-    sensor_readings = []
+    # Sample sensor readings: 24 hours of data, one column per sensor
     base_time = datetime.now()
+    hours = np.arange(24)
+    hourly = pd.DataFrame({
+        "ts": base_time - pd.to_timedelta(hours, unit="h"),
+        # Engine temperature (normal range: 180-220°F)
+        "engine_temp": 190 + (hours % 6) * 5,
+        # RPM (normal range: 600-3000 at idle/cruise)
+        "rpm": 800 + (hours % 4) * 200,
+        # Fuel level (0-100%)
+        "fuel_level": np.maximum(20, 100 - hours * 3),
+        # Speed (0-70 mph)
+        "speed": (hours % 8) * 10,
+        # Oil pressure (20-60 psi)
+        "oil_pressure": 30 + (hours % 3) * 10,
+        # Battery voltage (12-14V)
+        "battery_voltage": 12.5 + (hours % 2) * 0.5,
+    })
+    sensors = list(hourly.columns.drop("ts"))
     
-    for vehicle in vehicles:
-        # Generate 24 hours of sensor data
-        for hour in range(24):
-            timestamp = base_time - timedelta(hours=hour)
-            
-            # Engine temperature (normal range: 180-220°F)
-            temp = 190 + (hour % 6) * 5  # Varying temperature
-            
-            # RPM (normal range: 600-3000 at idle/cruise)
-            rpm = 800 + (hour % 4) * 200
-            
-            # Fuel level (0-100%)
-            fuel = max(20, 100 - hour * 3)
-            
-            # Speed (0-70 mph)
-            speed = (hour % 8) * 10
-            
-            # Oil pressure (20-60 psi)
-            oil_pressure = 30 + (hour % 3) * 10
-            
-            # Battery voltage (12-14V)
-            battery = 12.5 + (hour % 2) * 0.5
-            
-            # Add readings
-            sensor_readings.extend([
-                {"vehicle_id": vehicle["id"], "ts": timestamp, "sensor": "engine_temp", "value": temp},
-                {"vehicle_id": vehicle["id"], "ts": timestamp, "sensor": "rpm", "value": rpm},
-                {"vehicle_id": vehicle["id"], "ts": timestamp, "sensor": "fuel_level", "value": fuel},
-                {"vehicle_id": vehicle["id"], "ts": timestamp, "sensor": "speed", "value": speed},
-                {"vehicle_id": vehicle["id"], "ts": timestamp, "sensor": "oil_pressure", "value": oil_pressure},
-                {"vehicle_id": vehicle["id"], "ts": timestamp, "sensor": "battery_voltage", "value": battery},
-            ])
+    # Every vehicle gets the same hourly profile
+    wide = pd.DataFrame({"vehicle_id": [v["id"] for v in vehicles]}).merge(hourly, how="cross")
+    wide["_row"] = np.arange(len(wide))
+    long = wide.melt(
+        id_vars=["_row", "vehicle_id", "ts"],
+        value_vars=sensors,
+        var_name="sensor",
+        value_name="value"
+    )
+    # Vehicle, then hour, then sensor, as the nested loops produced
+    sensor_readings = long.sort_values("_row", kind="stable")[READING_COLUMNS]
     
     return vehicles, sensor_readings
 
 
-def load_kaggle_sensor_data(file_path: str) -> Optional[tuple]:
-    """Load sensor data from Kaggle dataset."""
-    try:
-        if not os.path.exists(file_path):
-            logger.warning(f"Kaggle dataset not found: {file_path}")
-            return None
+def extract_vehicles(df: pd.DataFrame, seen_vins: Dict[str, int]) -> List[Dict[str, Any]]:
+    """Vehicles first seen in this chunk; ids continue from seen_vins, which is updated."""
+    if 'vin' not in df.columns:
+        return []
+    
+    firsts = df.drop_duplicates('vin')
+    vehicles = []
+    for vin, make, model, year in zip(
+        firsts['vin'],
+        firsts.get('make', pd.Series('Unknown', index=firsts.index)),
+        firsts.get('model', pd.Series('Unknown', index=firsts.index)),
+        firsts.get('year', pd.Series(2020, index=firsts.index))
+    ):
+        vin = str(vin)
+        if vin in seen_vins:
+            continue
+        seen_vins[vin] = len(seen_vins) + 1
+        vehicles.append({"id": seen_vins[vin], "vin": vin, "make": make, "model": model, "year": year})
+    return vehicles
+
+
+def extract_sensor_readings(df: pd.DataFrame) -> pd.DataFrame:
+    """Map sensor alias columns to long-format (vehicle_id, ts, sensor, value) readings."""
+    # One wide column per sensor, then melt to long format
+    wide = pd.DataFrame({
+        "_row": range(len(df)),
+        "vehicle_id": df['vehicle_id'] if 'vehicle_id' in df.columns else 1,
+        "ts": pd.to_datetime(df['timestamp'] if 'timestamp' in df.columns else datetime.now())
+    }, index=df.index)
+    present = []
+    available = set(df.columns)
+    for sensor_name, possible_columns in SENSOR_MAPPINGS.items():
+        columns = [col for col in possible_columns if col in available]
+        if columns:
+            # First alias with a value wins, as in the per-row lookup this replaces
+            wide[sensor_name] = df[columns].astype(float).bfill(axis=1).iloc[:, 0]
+            present.append(sensor_name)
+    
+    if not present:
+        return pd.DataFrame(columns=READING_COLUMNS)
+    
+    long = wide.melt(
+        id_vars=["_row", "vehicle_id", "ts"],
+        value_vars=present,
+        var_name="sensor",
+        value_name="value"
+    ).dropna(subset=["value"])
+    # melt is sensor-major; a stable sort restores per-row sensor order
+    return long.sort_values("_row", kind="stable")[READING_COLUMNS]
+
+
+def iter_dataset_chunks(file_path: str) -> Iterator[pd.DataFrame]:
+    """Read a CSV or Parquet file KAGGLE_CHUNK_ROWS rows at a time."""
+    if file_path.endswith('.csv'):
+        yield from pd.read_csv(file_path, chunksize=KAGGLE_CHUNK_ROWS)
+    else:
+        import pyarrow.parquet as pq
         
-        # Read the dataset (assuming CSV or Parquet format)
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path)
-        elif file_path.endswith('.parquet'):
-            df = pd.read_parquet(file_path)
-        else:
-            logger.error(f"Unsupported file format: {file_path}")
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=KAGGLE_CHUNK_ROWS):
+            yield batch.to_pandas()
+
+
+def load_kaggle_sensor_data(file_path: str) -> Optional[Iterator[SensorBatch]]:
+    """Stream sensor data from Kaggle dataset as (new vehicles, readings) batches per chunk."""
+    if not os.path.exists(file_path):
+        logger.warning(f"Kaggle dataset not found: {file_path}")
+        return None
+    
+    # Read the dataset (assuming CSV or Parquet format)
+    if not file_path.endswith(('.csv', '.parquet')):
+        logger.error(f"Unsupported file format: {file_path}")
+        return None
+    
+    # Parse the first chunk up front so an unreadable file falls back before anything is saved
+    seen_vins: Dict[str, int] = {}
+    try:
+        chunks = iter_dataset_chunks(file_path)
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            logger.warning(f"Kaggle dataset is empty: {file_path}")
             return None
-        
-        logger.info(f"Loaded Kaggle dataset with {len(df)} rows")
-        
-        # Transform to our schema
-        vehicles = []
-        sensor_readings = []
-        
-        # Extract unique vehicles
-        if 'vin' in df.columns:
-            unique_vins = df['vin'].unique()
-            for i, vin in enumerate(unique_vins):
-                vehicle_data = df[df['vin'] == vin].iloc[0]
-                vehicles.append({
-                    "id": i + 1,
-                    "vin": str(vin),
-                    "make": vehicle_data.get('make', 'Unknown'),
-                    "model": vehicle_data.get('model', 'Unknown'),
-                    "year": vehicle_data.get('year', 2020)
-                })
-        
-        # Extract sensor readings
-        for _, row in df.iterrows():
-            # Map common sensor columns
-            sensor_mappings = {
-                'engine_temp': ['engine_temp', 'temperature', 'temp'],
-                'rpm': ['rpm', 'engine_rpm'],
-                'fuel_level': ['fuel_level', 'fuel', 'fuel_gauge'],
-                'speed': ['speed', 'vehicle_speed', 'mph'],
-                'oil_pressure': ['oil_pressure', 'oil'],
-                'battery_voltage': ['battery_voltage', 'battery', 'voltage']
-            }
-            
-            for sensor_name, possible_columns in sensor_mappings.items():
-                for col in possible_columns:
-                    if col in row and pd.notna(row[col]):
-                        sensor_readings.append({
-                            "vehicle_id": row.get('vehicle_id', 1),
-                            "ts": pd.to_datetime(row.get('timestamp', datetime.now())),
-                            "sensor": sensor_name,
-                            "value": float(row[col])
-                        })
-                        break
-        
-        return vehicles, sensor_readings
-        
+        first_batch = extract_vehicles(first_chunk, seen_vins), extract_sensor_readings(first_chunk)
     except Exception as e:
         logger.error(f"Error loading Kaggle dataset: {e}")
         return None
+    
+    def batches() -> Iterator[SensorBatch]:
+        rows = len(first_chunk)
+        yield first_batch
+        for chunk in chunks:
+            rows += len(chunk)
+            yield extract_vehicles(chunk, seen_vins), extract_sensor_readings(chunk)
+        logger.info(f"Loaded Kaggle dataset with {rows} rows")
+    
+    return batches()
+
 
+def save_sensor_data(
+    vehicles: List[Dict[str, Any]],
+    sensor_readings: Union[List[Dict[str, Any]], pd.DataFrame]
+) -> bool:
+    """Save sensor data to database; returns False if the save failed."""
+    return save_sensor_batches([(vehicles, sensor_readings)])
 
-def save_sensor_data(vehicles: List[Dict[str, Any]], sensor_readings: List[Dict[str, Any]]):
-    """Save sensor data to database."""
-    conn = sqlite3.connect(DB_PATH)
+
+def save_sensor_batches(batches: Iterable[SensorBatch], bulk_load: Optional[bool] = None) -> bool:
+    """Save (vehicles, readings) batches to database, committing once per batch.
+    
+    bulk_load defaults to whether the first batch has more than BULK_LOAD_ROWS readings.
+    Returns False if a batch failed; batches committed before it are kept.
+    """
+    conn = open_db()
     cursor = conn.cursor()
+    saved_vehicles = saved_readings = 0
     
     try:
-        # Save vehicles
-        for vehicle in vehicles:
-            cursor.execute(
+        # Peek at the first batch to size the load when the caller did not say
+        batches = iter(batches)
+        first_batch = next(batches, None)
+        if first_batch is None:
+            return True
+        batches = itertools.chain([first_batch], batches)
+        if bulk_load is None:
+            bulk_load = len(first_batch[1]) > BULK_LOAD_ROWS
+        
+        # On a cold or bulk load, build the indexes once after the insert instead of row by
+        # row; they are recreated below even if a later batch fails
+        cursor.execute("SELECT NOT EXISTS (SELECT 1 FROM sensor_reading)")
+        cold_load = bool(cursor.fetchone()[0])
+        if cold_load or bulk_load:
+            for name in SENSOR_READING_INDEXES:
+                cursor.execute(f"DROP INDEX IF EXISTS {name}")
+        
+        for vehicles, sensor_readings in batches:
+            # Vehicles and readings share one transaction until commit
+            cursor.execute("BEGIN")
+            cursor.executemany(
                 """INSERT OR REPLACE INTO vehicle (id, vin, make, model, year) 
                    VALUES (?, ?, ?, ?, ?)""",
-                (vehicle["id"], vehicle["vin"], vehicle["make"], vehicle["model"], vehicle["year"])
+                [(v["id"], v["vin"], v["make"], v["model"], v["year"]) for v in vehicles]
             )
-        
-        # Save sensor readings
-        for reading in sensor_readings:
-            cursor.execute(
-                """INSERT INTO sensor_reading (vehicle_id, ts, sensor, value) 
-                   VALUES (?, ?, ?, ?)""",
-                (reading["vehicle_id"], reading["ts"], reading["sensor"], reading["value"])
+            
+            # Multi-row INSERTs amortize statement parsing over READING_INSERT_CHUNK readings
+            if not isinstance(sensor_readings, pd.DataFrame):
+                sensor_readings = pd.DataFrame(sensor_readings, columns=READING_COLUMNS)
+            sensor_readings.to_sql(
+                "sensor_reading",
+                conn,
+                if_exists="append",
+                index=False,
+                method="multi",
+                chunksize=READING_INSERT_CHUNK
             )
+            
+            conn.commit()
+            saved_vehicles += len(vehicles)
+            saved_readings += len(sensor_readings)
         
-        conn.commit()
-        logger.info(f"Saved {len(vehicles)} vehicles and {len(sensor_readings)} sensor readings")
+        logger.info(f"Saved {saved_vehicles} vehicles and {saved_readings} sensor readings")
+        return True
         
     except Exception as e:
-        logger.error(f"Error saving sensor data: {e}")
+        logger.error(f"Error saving sensor data after {saved_readings} readings: {e}")
         conn.rollback()
+        return False
     finally:
+        try:
+            for name, target in SENSOR_READING_INDEXES.items():
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+        except Exception as e:
+            logger.error(f"Error creating sensor_reading indexes: {e}")
         conn.close()
 
 
+def build_analytics_query(vehicle_id: Optional[int] = None, sensor: Optional[str] = None):
+    """Build the per-vehicle, per-sensor aggregate query and its parameters."""
+    query = """
+    SELECT 
+        sr.vehicle_id,
+        v.vin,
+        sr.sensor,
+        AVG(sr.value) as avg_value,
+        MIN(sr.value) as min_value,
+        MAX(sr.value) as max_value,
+        COUNT(*) as reading_count
+    FROM sensor_reading sr
+    JOIN vehicle v ON sr.vehicle_id = v.id
+    WHERE 1=1
+    """
+    params = []
+    
+    if vehicle_id:
+        query += " AND sr.vehicle_id = ?"
+        params.append(vehicle_id)
+    
+    if sensor:
+        query += " AND sr.sensor = ?"
+        params.append(sensor)
+    
+    query += " GROUP BY sr.vehicle_id, sr.sensor"
+    return query, params
+
+
 def get_sensor_analytics(vehicle_id: Optional[int] = None, sensor: Optional[str] = None):
     """Get sensor analytics and anomalies."""
-    conn = sqlite3.connect(DB_PATH)
+    conn = open_db()
     
     try:
-        # Build query
-        query = """
-        SELECT 
-            sr.vehicle_id,
-            v.vin,
-            sr.sensor,
-            AVG(sr.value) as avg_value,
-            MIN(sr.value) as min_value,
-            MAX(sr.value) as max_value,
-            COUNT(*) as reading_count
-        FROM sensor_reading sr
-        JOIN vehicle v ON sr.vehicle_id = v.id
-        WHERE 1=1
-        """
-        params = []
-        
-        if vehicle_id:
-            query += " AND sr.vehicle_id = ?"
-            params.append(vehicle_id)
-        
-        if sensor:
-            query += " AND sr.sensor = ?"
-            params.append(sensor)
-        
-        query += " GROUP BY sr.vehicle_id, sr.sensor"
-        
+        query, params = build_analytics_query(vehicle_id, sensor)
         df = pd.read_sql_query(query, conn, params=params)
         return df
         
@@ -198,9 +316,26 @@ def get_sensor_analytics(vehicle_id: Optional[int] = None, sensor: Optional[str]
         conn.close()
 
 
+def get_sensor_analytics_rows(
+    vehicle_id: Optional[int] = None, sensor: Optional[str] = None
+) -> List[tuple]:
+    """Get sensor analytics as plain row tuples, without building a DataFrame."""
+    conn = open_db()
+    
+    try:
+        query, params = build_analytics_query(vehicle_id, sensor)
+        return conn.execute(query, params).fetchall()
+        
+    except Exception as e:
+        logger.error(f"Error getting sensor analytics: {e}")
+        return []
+    finally:
+        conn.close()
+
+
 def detect_anomalies(vehicle_id: Optional[int] = None):
     """Detect sensor anomalies based on thresholds."""
-    conn = sqlite3.connect(DB_PATH)
+    conn = open_db()
     
     # Define normal ranges for sensors
     thresholds = {
@@ -212,37 +347,32 @@ def detect_anomalies(vehicle_id: Optional[int] = None):
         'battery_voltage': {'min': 11.5, 'max': 14.5, 'unit': 'V'}
     }
     
-    anomalies = []
-    
     try:
-        for sensor, threshold in thresholds.items():
-            query = """
-            SELECT sr.*, v.vin
-            FROM sensor_reading sr
-            JOIN vehicle v ON sr.vehicle_id = v.id
-            WHERE sr.sensor = ? AND (sr.value < ? OR sr.value > ?)
-            """
-            params = [sensor, threshold['min'], threshold['max']]
-            
-            if vehicle_id:
-                query += " AND sr.vehicle_id = ?"
-                params.append(vehicle_id)
-            
-            cursor = conn.cursor()
-            cursor.execute(query, params)
-            results = cursor.fetchall()
-            
-            for result in results:
-                anomalies.append({
-                    'vehicle_id': result[0],
-                    'vin': result[4],
-                    'sensor': result[2],
-                    'value': result[3],
-                    'timestamp': result[1],
-                    'threshold_min': threshold['min'],
-                    'threshold_max': threshold['max'],
-                    'unit': threshold['unit']
-                })
+        # One query joining the readings against an inline threshold table
+        threshold_rows = ", ".join(["(?, ?, ?, ?, ?)"] * len(thresholds))
+        query = f"""
+        WITH t(ord, sensor, min_v, max_v, unit) AS (VALUES {threshold_rows})
+        SELECT sr.vehicle_id, v.vin, sr.sensor, sr.value, sr.ts AS "timestamp",
+               t.min_v AS threshold_min, t.max_v AS threshold_max, t.unit
+        FROM t
+        JOIN sensor_reading sr ON sr.sensor = t.sensor
+        JOIN vehicle v ON sr.vehicle_id = v.id
+        WHERE (sr.value < t.min_v OR sr.value > t.max_v)
+        """
+        params = []
+        for position, (sensor, threshold) in enumerate(thresholds.items()):
+            params.extend([position, sensor, threshold['min'], threshold['max'], threshold['unit']])
+        
+        if vehicle_id:
+            query += " AND sr.vehicle_id = ?"
+            params.append(vehicle_id)
+        
+        # Same order as the former per-sensor queries: threshold order, then insertion order
+        query += " ORDER BY t.ord, sr.rowid"
+        
+        # Rows come back keyed by the column aliases above
+        conn.row_factory = sqlite3.Row
+        anomalies = [dict(row) for row in conn.execute(query, params).fetchall()]
         
         return anomalies
         
@@ -255,18 +385,21 @@ def detect_anomalies(vehicle_id: Optional[int] = None):
 
 if __name__ == "__main__":
     # Try to load Kaggle dataset first
-    kaggle_data = load_kaggle_sensor_data("data/automobile_telematics.csv")
+    kaggle_batches = load_kaggle_sensor_data("data/automobile_telematics.csv")
     
-    if kaggle_data:
-        vehicles, sensor_readings = kaggle_data
+    saved = False
+    if kaggle_batches:
         logger.info("Using Kaggle dataset")
-    else:
+        # Save to database chunk by chunk
+        saved = save_sensor_batches(kaggle_batches)
+    
+    if not saved:
         # Fall back to sample data
         vehicles, sensor_readings = create_sample_sensor_data()
         logger.info("Using sample sensor data")
-    
-    # Save to database
-    save_sensor_data(vehicles, sensor_readings)
+        
+        # Save to database
+        save_sensor_data(vehicles, sensor_readings)
     
     # Show analytics
     print("\n=== Sensor Analytics ===")
@@ -23,6 +23,14 @@ CREATE TABLE recall (
     summary TEXT
 );
 
+-- vPIC decodes keyed by VIN positions 1-8 + 10-11 (WMI + VDS, model year, plant; no check digit)
+CREATE TABLE vin_decode (
+    vin_key CHAR(10) PRIMARY KEY,
+    make TEXT,
+    model TEXT,
+    year TEXT
+);
+
 -- time‑series sensors (partition later if needed)
 CREATE TABLE sensor_reading (
     id BIGSERIAL PRIMARY KEY,
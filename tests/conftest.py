@@ -0,0 +1,14 @@
+import httpx
+import pytest_asyncio
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def client():
+    """Shared API client; one connection pool for the whole test session (per xdist worker)."""
+    # Keep-alive connections outlive the gaps between tests; HTTP/2 multiplexes when available
+    async with httpx.AsyncClient(
+        base_url="http://localhost:8000",
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=30)
+    ) as client:
+        yield client
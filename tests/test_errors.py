@@ -0,0 +1,21 @@
+import pytest
+
+from agent.errors import InvalidVINError, validate_vin, vin_check_digit
+
+
+@pytest.mark.parametrize("vin, expected", [
+    ("1HGCM82633A004352", "3"),
+    ("1M8GDM9AXKP042788", "X"),
+])
+def test_vin_check_digit(vin: str, expected: str):
+    """Check digits match published reference VINs."""
+    assert vin_check_digit(vin) == expected
+    assert validate_vin(vin.lower(), check_digit=True) == vin
+
+
+def test_vin_check_digit_rejects_corruption():
+    """A single mistyped character fails the check digit but not the format check."""
+    corrupted = "1HGCM82633A004353"
+    assert validate_vin(corrupted) == corrupted
+    with pytest.raises(InvalidVINError):
+        validate_vin(corrupted, check_digit=True)
@@ -1,21 +1,24 @@
 import streamlit as st
 import httpx
 import asyncio
+import concurrent.futures
+import gc
 import json
-from datetime import datetime
-from typing import Optional, Dict, Any, List
+import os
+import re
+import sys
+import threading
+from collections import defaultdict
+from typing import Optional, Dict, Any, List, AsyncIterator, Iterator
 import time
 
-# Page configuration
-st.set_page_config(
-    page_title="AutoSense - AI Diagnostic Platform",
-    page_icon="🚗",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+# Make the repo root importable when run as `streamlit run ui/app.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.errors import ensure_valid_input
 
 # Custom CSS for better styling
-st.markdown("""
+CUSTOM_CSS = """
 <style>
     .main-header {
         font-size: 3rem;
@@ -50,27 +53,167 @@ st.markdown("""
         border-left: 4px solid #4caf50;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
 
 # Configuration
 API_BASE_URL = st.secrets.get("API_BASE_URL", "http://localhost:8000")
+# DTC fetched alongside the health check so the first real lookup is warm
+WARMUP_DTC_CODE = "P0420"
+HEALTH_REFRESH_SECONDS = 30
+STATUS_POLL_SECONDS = 0.5
+VIN_RE = re.compile(r"^[A-HJ-NPR-Z0-9]{17}$")
+
+# Example queries offered below the main form
+EXAMPLE_QUERIES = (
+    "P0420 catalyst efficiency below threshold",
+    "Engine misfiring and rough idle",
+    "Check engine light is on",
+    "2HGFC2F59JH000001 recalls",
+    "P0300 random misfire detected",
+    "System too lean bank 1"
+)
+
+# One markdown string per result, so each expander is a single message to the frontend
+SEARCH_RESULT_TEMPLATES = {
+    "dtc": "**DTC Code:** {code}\n\n**Category:** {category}\n\n**Description:** {description}",
+    "recall": "**Recall ID:** {rid}\n\n**Date:** {date}\n\n**Summary:** {summary}"
+}
+SOURCE_TEMPLATES = {
+    "dtc": "**DTC:** {code}\n\n**Description:** {description}",
+    "recall": "**Recall:** {rid}\n\n**Summary:** {summary}"
+}
+
+
+def format_result(template: str, result: Dict[str, Any]) -> str:
+    """Fill a result template, showing N/A for missing fields."""
+    return template.format_map(defaultdict(lambda: "N/A", result))
+
+
+@st.cache_resource
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Background event loop shared by every rerun and session."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+@st.cache_resource
+def get_http_client() -> httpx.AsyncClient:
+    """Pooled HTTP client; only ever used on the shared event loop, so its connections stay alive."""
+    # A custom transport ignores the client's http2/limits, so they are set on the transport
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=32, keepalive_expiry=30.0),
+        retries=1
+    )
+    return httpx.AsyncClient(timeout=30.0, transport=transport)
+
+
+def run_async(coro):
+    """Run a coroutine on the shared event loop and wait for its result."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
+
+
+def run_with_status(coro, label: str):
+    """Run a coroutine on the shared event loop, showing its elapsed time in an st.status box."""
+    future = asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+    start_time = time.monotonic()
+    with st.status(f"{label}...") as status:
+        while not concurrent.futures.wait([future], timeout=STATUS_POLL_SECONDS).done:
+            status.update(label=f"{label}... {time.monotonic() - start_time:.0f}s")
+        status.update(label=f"{label}: done in {time.monotonic() - start_time:.1f}s", state="complete")
+    return future.result()
+
+
+async def _anext(agen: AsyncIterator[Any], default: Any) -> Any:
+    """anext() as a coroutine, which run_coroutine_threadsafe requires."""
+    try:
+        return await agen.__anext__()
+    except StopAsyncIteration:
+        return default
+
+
+def iter_async(agen: AsyncIterator[Any]) -> Iterator[Any]:
+    """Drive an async generator on the shared event loop from the script thread."""
+    done = object()
+    while (item := run_async(_anext(agen, done))) is not done:
+        yield item
+
+
+async def get_health_with_warmup(api_base_url: str) -> httpx.Response:
+    """GET /health while warming the DTC lookup path on the same connection."""
+    client = get_http_client()
+    health, _ = await asyncio.gather(
+        client.get(f"{api_base_url}/health"),
+        client.get(f"{api_base_url}/dtc/{WARMUP_DTC_CODE}"),
+        return_exceptions=True
+    )
+    if isinstance(health, Exception):
+        raise health
+    return health
+
+
+# Read-only GETs are memoized across reruns so toggling a widget doesn't refetch them
+@st.cache_data(ttl=10, show_spinner=False)
+def fetch_health(api_base_url: str) -> Dict[str, Any]:
+    """Check API health status."""
+    try:
+        response = run_async(get_health_with_warmup(api_base_url))
+        response.raise_for_status()
+        return response.json()
+    except Exception as e:
+        return {"status": "unhealthy", "error": str(e)}
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_dtc_info(api_base_url: str, code: str) -> Optional[Dict[str, Any]]:
+    """Get detailed DTC information."""
+    try:
+        response = run_async(get_http_client().get(f"{api_base_url}/dtc/{code}"))
+        if response.status_code == 200:
+            return response.json()
+        return None
+    except Exception:
+        return None
+
+
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_recalls(api_base_url: str, vin: str) -> List[Dict[str, Any]]:
+    """Get recalls for a VIN."""
+    try:
+        response = run_async(get_http_client().get(f"{api_base_url}/recalls/{vin}"))
+        if response.status_code == 200:
+            data = response.json()
+            return data.get("recalls", [])
+        return []
+    except Exception:
+        return []
+
+
+def clear_query_inputs():
+    """Blank the diagnostic form inputs."""
+    st.session_state.query = ""
+    st.session_state.vin = ""
+
+
+def use_example_query():
+    """Load the selected example into the diagnostic form's query input."""
+    if st.session_state.example:
+        st.session_state.query = st.session_state.example
 
 
 class AutoSenseUI:
     """Streamlit UI for AutoSense diagnostic platform."""
     
-    def __init__(self):
-        self.api_base_url = API_BASE_URL
-        self.http_client = httpx.AsyncClient(timeout=30.0)
+    def __init__(self, api_base_url: str = API_BASE_URL, enable_agent: bool = True):
+        self.api_base_url = api_base_url
+        # The agent-less variant is the local demo served by api_local.py
+        self.enable_agent = enable_agent
+        self.http_client = get_http_client()
     
-    async def check_health(self) -> Dict[str, Any]:
+    def check_health(self) -> Dict[str, Any]:
         """Check API health status."""
-        try:
-            response = await self.http_client.get(f"{self.api_base_url}/health")
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            return {"status": "unhealthy", "error": str(e)}
+        return fetch_health(self.api_base_url)
     
     async def search(self, query: str, vin: Optional[str] = None, k: int = 5) -> Dict[str, Any]:
         """Search for diagnostic information."""
@@ -85,60 +228,51 @@ class AutoSenseUI:
         except Exception as e:
             return {"error": str(e)}
     
-    async def get_dtc_info(self, code: str) -> Optional[Dict[str, Any]]:
+    def get_dtc_info(self, code: str) -> Optional[Dict[str, Any]]:
         """Get detailed DTC information."""
-        try:
-            response = await self.http_client.get(f"{self.api_base_url}/dtc/{code}")
-            if response.status_code == 200:
-                return response.json()
-            return None
-        except Exception:
-            return None
+        return fetch_dtc_info(self.api_base_url, code)
     
-    async def get_recalls(self, vin: str) -> List[Dict[str, Any]]:
+    def get_recalls(self, vin: str) -> List[Dict[str, Any]]:
         """Get recalls for a VIN."""
-        try:
-            response = await self.http_client.get(f"{self.api_base_url}/recalls/{vin}")
-            if response.status_code == 200:
-                data = response.json()
-                return data.get("recalls", [])
-            return []
-        except Exception:
-            return []
+        return fetch_recalls(self.api_base_url, vin)
     
-    async def run_agent_diagnosis(self, query: str, vin: Optional[str] = None) -> Dict[str, Any]:
-        """Run the ReAct agent for comprehensive diagnosis."""
+    async def diagnose_stream(self, query: str, vin: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Run the agent server-side in one request, yielding its Server-Sent Events."""
+        payload = {"query": query}
+        if vin:
+            payload["vin"] = vin
+        
+        async with self.http_client.stream("POST", f"{self.api_base_url}/agent/stream", json=payload) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.startswith("data: "):
+                    yield json.loads(line[len("data: "):])
+    
+    def stream_agent_diagnosis(self, query: str, vin: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Run the ReAct agent, yielding its context, token and done/error events as they arrive."""
+        validation = ensure_valid_input(query, vin)
+        if not validation.get("is_valid", True):
+            yield {
+                "event": "error",
+                "error": validation.get("error", "Validation failed"),
+                "suggestion": validation.get("suggestion", "Please check your input")
+            }
+            return
+        
         try:
-            # Import the agent here to avoid circular imports
-            import sys
-            import os
-            sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-            
-            from agent.core import AutoSenseAgent
-            from agent.errors import ensure_valid_input
-            
-            # Validate input
-            validation = ensure_valid_input(query, vin)
-            if not validation.get("is_valid", True):
-                return {
-                    "error": validation.get("error", "Validation failed"),
-                    "suggestion": validation.get("suggestion", "Please check your input")
-                }
-            
-            # Run agent
-            agent = AutoSenseAgent(self.api_base_url)
-            result = await agent.react(query, vin)
-            await agent.close()
-            
-            return result
-            
+            yield from iter_async(self.diagnose_stream(query, vin))
         except Exception as e:
-            return {"error": f"Agent diagnosis failed: {str(e)}"}
+            yield {"event": "error", "error": f"Agent diagnosis failed: {str(e)}"}
     
+    @st.fragment
     def render_header(self):
         """Render the main header."""
-        st.markdown('<h1 class="main-header">🚗 AutoSense</h1>', unsafe_allow_html=True)
-        st.markdown('<p style="text-align: center; font-size: 1.2rem; color: #666;">AI Diagnostic Platform for Connected Cars</p>', unsafe_allow_html=True)
+        if self.enable_agent:
+            st.markdown('<h1 class="main-header">🚗 AutoSense</h1>', unsafe_allow_html=True)
+            st.markdown('<p style="text-align: center; font-size: 1.2rem; color: #666;">AI Diagnostic Platform for Connected Cars</p>', unsafe_allow_html=True)
+        else:
+            st.markdown('<h1 class="main-header">🚗 AutoSense Local Demo</h1>', unsafe_allow_html=True)
+            st.markdown('<p style="text-align: center; font-size: 1.2rem; color: #666;">AI Diagnostic Platform - Local Version</p>', unsafe_allow_html=True)
     
     def render_sidebar(self):
         """Render the sidebar with configuration options."""
@@ -146,12 +280,15 @@ class AutoSenseUI:
         
         # API Status
         st.sidebar.subheader("API Status")
-        if st.button("Check Health"):
-            health_status = asyncio.run(self.check_health())
-            if health_status.get("status") == "healthy":
-                st.sidebar.success("✅ API Healthy")
-            else:
-                st.sidebar.error("❌ API Unhealthy")
+        # The last result persists across reruns and is refreshed when stale or on demand
+        health_age = time.monotonic() - st.session_state.get("health_ts", float("-inf"))
+        if st.sidebar.button("Check Health") or health_age > HEALTH_REFRESH_SECONDS:
+            st.session_state.health = self.check_health()
+            st.session_state.health_ts = time.monotonic()
+        if st.session_state.health.get("status") == "healthy":
+            st.sidebar.success("✅ API Healthy")
+        else:
+            st.sidebar.error("❌ API Unhealthy")
         
         # Search Configuration
         st.sidebar.subheader("Search Settings")
@@ -160,6 +297,9 @@ class AutoSenseUI:
         # Advanced Options
         st.sidebar.subheader("Advanced Options")
         show_debug = st.sidebar.checkbox("Show Debug Info", False)
+        if show_debug:
+            with st.sidebar.expander("GC stats"):
+                st.json(gc.get_stats())
         
         return {
             "k_results": k_results,
@@ -178,36 +318,46 @@ class AutoSenseUI:
                 query = st.text_area(
                     "Describe the problem or enter a DTC code",
                     placeholder="e.g., 'My car is showing P0420 error code' or 'Engine misfiring'",
-                    height=100
+                    height=100,
+                    key="query"
                 )
             
             with col2:
                 vin = st.text_input(
                     "VIN (optional)",
                     placeholder="17-character VIN",
-                    max_chars=17
+                    max_chars=17,
+                    key="vin"
                 )
             
-            col1, col2, col3 = st.columns(3)
-            with col1:
+            cols = st.columns(3 if self.enable_agent else 2)
+            with cols[0]:
                 search_button = st.form_submit_button("🔍 Search", use_container_width=True)
-            with col2:
-                diagnose_button = st.form_submit_button("🤖 AI Diagnosis", use_container_width=True)
-            with col3:
-                clear_button = st.form_submit_button("🗑️ Clear", use_container_width=True)
+            diagnose_button = False
+            if self.enable_agent:
+                with cols[1]:
+                    diagnose_button = st.form_submit_button("🤖 AI Diagnosis", use_container_width=True)
+            with cols[-1]:
+                # The callback blanks the inputs before the rerun the click already triggers
+                st.form_submit_button("🗑️ Clear", on_click=clear_query_inputs, use_container_width=True)
+        
+        # Reject malformed VINs here rather than spending a round trip on them
+        vin = vin.strip().upper()
+        if (search_button or diagnose_button) and vin and not VIN_RE.match(vin):
+            st.error("Invalid VIN: expected 17 characters, letters and digits except I, O and Q")
+            return
         
         # Handle form submission
         if search_button and query:
             self.handle_search(query, vin, config)
         elif diagnose_button and query:
             self.handle_diagnosis(query, vin, config)
-        elif clear_button:
-            st.rerun()
     
     def handle_search(self, query: str, vin: Optional[str], config: Dict[str, Any]):
         """Handle search request."""
-        with st.spinner("Searching for diagnostic information..."):
-            results = asyncio.run(self.search(query, vin, config["k_results"]))
+        results = run_with_status(
+            self.search(query, vin, config["k_results"]), "Searching for diagnostic information"
+        )
         
         if "error" in results:
             st.error(f"Search failed: {results['error']}")
@@ -218,101 +368,124 @@ class AutoSenseUI:
         
         for i, result in enumerate(results['results'], 1):
             with st.expander(f"Result {i} (Score: {result['score']:.3f})"):
-                if result.get("type") == "dtc":
-                    st.markdown(f"**DTC Code:** {result.get('code', 'N/A')}")
-                    st.markdown(f"**Category:** {result.get('category', 'N/A')}")
-                    st.markdown(f"**Description:** {result.get('description', 'N/A')}")
-                elif result.get("type") == "recall":
-                    st.markdown(f"**Recall ID:** {result.get('rid', 'N/A')}")
-                    st.markdown(f"**Date:** {result.get('date', 'N/A')}")
-                    st.markdown(f"**Summary:** {result.get('summary', 'N/A')}")
+                template = SEARCH_RESULT_TEMPLATES.get(result.get("type"))
+                if template:
+                    st.markdown(format_result(template, result))
         
         if config["show_debug"]:
             st.json(results)
     
+    def render_diagnosis_metrics(self, placeholder, processing_time: float, context: Dict[str, Any]):
+        """Render the diagnosis metrics into a placeholder so they can be updated in place."""
+        with placeholder.container():
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Processing Time", f"{processing_time:.2f}s")
+            with col2:
+                st.metric("Search Results", len(context.get("search_results", [])))
+            with col3:
+                st.metric("Recalls Found", len(context.get("recalls", [])))
+    
     def handle_diagnosis(self, query: str, vin: Optional[str], config: Dict[str, Any]):
-        """Handle AI diagnosis request."""
-        with st.spinner("Running AI diagnosis..."):
-            result = asyncio.run(self.run_agent_diagnosis(query, vin))
-        
-        if "error" in result:
-            st.error(f"Diagnosis failed: {result['error']}")
-            return
+        """Handle AI diagnosis request, streaming the answer as it is generated."""
+        start_time = time.perf_counter()
+        events: Dict[str, Dict[str, Any]] = {}
         
         # Display diagnosis
         st.subheader("🤖 AI Diagnosis")
+        status = st.status("Gathering diagnostic context...")
+        metrics = st.empty()
+        
+        def answer_tokens() -> Iterator[str]:
+            """Yield answer tokens for st.write_stream, keeping the other events aside."""
+            for event in self.stream_agent_diagnosis(query, vin):
+                if event["event"] == "token":
+                    yield event["content"]
+                    continue
+                events[event["event"]] = event
+                if event["event"] == "context":
+                    status.update(label="Diagnostic context gathered, generating answer", state="complete")
+                    self.render_diagnosis_metrics(metrics, time.perf_counter() - start_time, event)
+                elif event["event"] == "error":
+                    status.update(label="Diagnosis failed", state="error")
         
         # Main answer
         st.markdown("### Analysis")
-        st.markdown(result.get("answer", "No analysis available"))
+        answer = st.write_stream(answer_tokens())
+        
+        if "error" in events:
+            st.error(f"Diagnosis failed: {events['error']['error']}")
+            return
         
-        # Metrics
-        col1, col2, col3 = st.columns(3)
-        with col1:
-            st.metric("Processing Time", f"{result.get('processing_time', 0):.2f}s")
-        with col2:
-            st.metric("Search Results", len(result.get("search_results", [])))
-        with col3:
-            st.metric("Recalls Found", len(result.get("recalls", [])))
+        context = events.get("context", {})
+        done = events.get("done", {})
+        self.render_diagnosis_metrics(
+            metrics, done.get("processing_time", time.perf_counter() - start_time), context
+        )
         
         # Detailed information
-        if result.get("search_results"):
+        if context.get("search_results"):
             st.subheader("📋 Supporting Information")
-            for i, search_result in enumerate(result["search_results"][:3], 1):
+            for i, search_result in enumerate(context["search_results"][:3], 1):
                 with st.expander(f"Source {i}"):
-                    if search_result.get("type") == "dtc":
-                        st.markdown(f"**DTC:** {search_result.get('code')}")
-                        st.markdown(f"**Description:** {search_result.get('description')}")
-                    else:
-                        st.markdown(f"**Recall:** {search_result.get('rid')}")
-                        st.markdown(f"**Summary:** {search_result.get('summary')}")
+                    template = SOURCE_TEMPLATES["dtc" if search_result.get("type") == "dtc" else "recall"]
+                    st.markdown(format_result(template, search_result))
         
-        if result.get("recalls"):
+        if context.get("recalls"):
             st.subheader("⚠️ Active Recalls")
-            for recall in result["recalls"][:3]:
+            for recall in context["recalls"][:3]:
                 st.warning(f"**Recall {recall.get('nhtsa_id')}:** {recall.get('summary')}")
         
         if config["show_debug"]:
             st.subheader("🔧 Debug Information")
-            st.json(result)
+            st.json({**context, "answer": answer, **done})
     
     def render_examples(self):
         """Render example queries."""
-        st.subheader("💡 Example Queries")
-        
-        examples = [
-            "P0420 catalyst efficiency below threshold",
-            "Engine misfiring and rough idle",
-            "Check engine light is on",
-            "2HGFC2F59JH000001 recalls",
-            "P0300 random misfire detected",
-            "System too lean bank 1"
-        ]
-        
-        cols = st.columns(2)
-        for i, example in enumerate(examples):
-            with cols[i % 2]:
-                if st.button(example, key=f"example_{i}"):
-                    st.session_state.example_query = example
-                    st.rerun()
+        st.selectbox(
+            "💡 Example Queries",
+            EXAMPLE_QUERIES,
+            index=None,
+            placeholder="Pick an example to load it into the query box",
+            key="example",
+            on_change=use_example_query
+        )
     
+    @st.fragment
     def render_footer(self):
         """Render the footer."""
+        if self.enable_agent:
+            tagline = "AI Diagnostic Platform for Connected Cars"
+            stack = "FastAPI, Qdrant, and Streamlit"
+        else:
+            tagline = "AI Diagnostic Platform (Local Demo)"
+            stack = "FastAPI and Streamlit"
+        
         st.markdown("---")
         st.markdown(
-            """
+            f"""
             <div style="text-align: center; color: #666; font-size: 0.9rem;">
-                <p>AutoSense - AI Diagnostic Platform for Connected Cars</p>
-                <p>Built with FastAPI, Qdrant, and Streamlit</p>
+                <p>AutoSense - {tagline}</p>
+                <p>Built with {stack}</p>
             </div>
             """,
             unsafe_allow_html=True
         )
 
 
-def main():
+def main(api_base_url: str = API_BASE_URL, enable_agent: bool = True):
     """Main Streamlit application."""
-    ui = AutoSenseUI()
+    st.set_page_config(
+        page_title="AutoSense - AI Diagnostic Platform" if enable_agent else "AutoSense - Local Demo",
+        page_icon="🚗",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    
+    # Streamlit redraws the page on every rerun, so the styles are re-emitted each time
+    st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
+    
+    ui = AutoSenseUI(api_base_url, enable_agent=enable_agent)
     
     # Render header
     ui.render_header()
@@ -320,11 +493,6 @@ def main():
     # Render sidebar
     config = ui.render_sidebar()
     
-    # Check for example query
-    if "example_query" in st.session_state:
-        st.text_area("Query", value=st.session_state.example_query, key="query_input")
-        del st.session_state.example_query
-    
     # Render main interface
     ui.render_main_interface(config)
     